@@ -8,22 +8,36 @@ import eventlet
 eventlet.monkey_patch()
 
 # Now import other modules
+from eventlet import tpool
 import os
 import sys
 import json
 import time
 import uuid
+import hashlib
+import tempfile
 import re
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
+from flask import Flask, request, jsonify, send_file, send_from_directory, Response, stream_with_context, redirect
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 import logging
 import requests
-import yt_dlp
-from urllib.parse import unquote, urljoin
+from urllib.parse import unquote, urljoin, urlsplit, parse_qsl
 import random
+import threading
+from functools import wraps
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from metrics import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from ratelimit import MemoryBucketStore, RedisBucketStore, RateLimiter, parse_budget
+from staticfiles import StaticFiles, is_versioned
+from thumbnails import ThumbnailCache, resize_image, variant_width
+from downloads import DownloadRecord, DownloadStore
+from profiles import HarvestState, iter_profile_videos, profile_username
+from mp4 import MP4Error, plan_faststart, probe_metadata
+from werkzeug.http import http_date, parse_date
 
 # Disable SSL warnings
 import urllib3
@@ -35,6 +49,8 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'tiktok-fixed-downloader-prod')
+# Behind nginx/Apache, let the proxy send finished job files straight from disk
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
 
 # Production CORS settings
 if os.environ.get('NODE_ENV') == 'production':
@@ -53,8 +69,400 @@ socketio = SocketIO(app,
                    engineio_logger=False,
                    async_mode='eventlet')
 
+# Download history: in-flight records plus the most recent finished ones
+DOWNLOAD_HISTORY_SIZE = int(os.environ.get('DOWNLOAD_HISTORY_SIZE', 500))
+DOWNLOADS_PAGE_SIZE = 50
+DOWNLOADS_MAX_PAGE_SIZE = 200
+IN_PROGRESS_STATUSES = ('queued', 'starting', 'streaming', 'downloading', 'ready')
+# How often connected dashboards get a downloads_delta with what changed
+DELTA_SYNC_INTERVAL = float(os.environ.get('DELTA_SYNC_INTERVAL', 1.0))
+delta_sync_thread = None
+
 # Global variables
-active_downloads = {}
+active_downloads = DownloadStore(DOWNLOAD_HISTORY_SIZE)
+
+# Warm cache filled by the /api/video-info background prefetch
+PREFETCH_TTL = int(os.environ.get('PREFETCH_TTL', 120))
+PROBE_TIMEOUT = float(os.environ.get('PROBE_TIMEOUT', 3))
+# Signed CDN URLs are cached until just before they expire, up to URL_CACHE_MAX_TTL
+URL_CACHE_MAX_TTL = int(os.environ.get('URL_CACHE_MAX_TTL', 3600))
+URL_EXPIRY_MARGIN = int(os.environ.get('URL_EXPIRY_MARGIN', 60))
+# Entries hit this often are re-extracted in the background before they expire
+URL_REFRESH_MIN_HITS = int(os.environ.get('URL_REFRESH_MIN_HITS', 3))
+URL_REFRESH_AHEAD = int(os.environ.get('URL_REFRESH_AHEAD', 120))
+# Most URLs the cache holds; the least recently used are dropped first
+URL_CACHE_MAX_ENTRIES = int(os.environ.get('URL_CACHE_MAX_ENTRIES', 1000))
+prefetched_videos = OrderedDict()
+prefetch_jobs = {}
+
+# Stream read sizes adapt to throughput between these bounds
+STREAM_CHUNK_MIN = int(os.environ.get('STREAM_CHUNK_MIN', 32768))
+STREAM_CHUNK_MAX = int(os.environ.get('STREAM_CHUNK_MAX', 1048576))
+STREAM_CHUNK_INTERVAL = 0.1  # seconds of data per read at the observed rate
+STREAM_RESIZE_INTERVAL = 0.25
+
+# Stall watchdog: abort streams whose CDN goes quiet or trickles
+STREAM_IDLE_TIMEOUT = float(os.environ.get('STREAM_IDLE_TIMEOUT', 20))
+STREAM_MIN_BPS = int(os.environ.get('STREAM_MIN_BPS', 8192))
+STREAM_STALL_WINDOW = float(os.environ.get('STREAM_STALL_WINDOW', 30))
+
+# Heavy optional imports are deferred until after the server is serving requests
+PREWARM_DELAY = float(os.environ.get('PREWARM_DELAY', 5))
+yt_dlp = None
+_prewarm_started = False
+
+# Thumbnails are fetched once per video and served as small cached variants
+THUMBNAIL_CACHE_DIR = os.environ.get('THUMBNAIL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'tiktok_thumbnails'))
+THUMBNAIL_MEMORY_MB = int(os.environ.get('THUMBNAIL_MEMORY_MB', 8))
+THUMBNAIL_DISK_MB = int(os.environ.get('THUMBNAIL_DISK_MB', 128))
+THUMBNAIL_MAX_BYTES = 5 * 1024 * 1024
+THUMBNAIL_MAX_SOURCES = 5000
+thumbnail_sources = {}
+thumbnail_jobs = {}
+
+# Redirect mode: hand clients the CDN URL for providers that need no custom headers
+REDIRECT_MODE = os.environ.get('REDIRECT_MODE', 'auto').lower()  # auto or off
+REDIRECT_MIN_SAMPLES = int(os.environ.get('REDIRECT_MIN_SAMPLES', 5))
+REDIRECT_MAX_FAILURE_RATIO = float(os.environ.get('REDIRECT_MAX_FAILURE_RATIO', 0.1))
+REDIRECT_REPROBE_RATE = float(os.environ.get('REDIRECT_REPROBE_RATE', 0.1))
+redirect_stats = {}
+
+# Profile harvesting: every video of an @username, fed into background jobs
+PROFILE_STATE_DIR = os.environ.get('PROFILE_STATE_DIR', os.path.join(tempfile.gettempdir(), 'tiktok_profiles'))
+PROFILE_CONCURRENCY = int(os.environ.get('PROFILE_CONCURRENCY', 3))
+PROFILE_HISTORY_TTL = 3600
+MAX_PROFILE_HARVESTS = int(os.environ.get('MAX_PROFILE_HARVESTS', 2))
+PROFILE_CAPACITY_WAIT = 5  # seconds between checks while a harvest waits for room
+profile_harvests = {}
+# Files downloaded by harvests, by download id, until they expire; kept apart from the bounded history
+harvest_files = {}
+
+# Optionally send moov-at-end MP4s in faststart order so playback can begin right away
+MP4_FASTSTART = os.environ.get('MP4_FASTSTART', 'false').lower() == 'true'
+MP4_HEAD_BYTES = 65536
+MP4_MAX_MOOV_MB = int(os.environ.get('MP4_MAX_MOOV_MB', 8))
+# Video info reads duration and size from the first few KB of the MP4 when the provider omits them
+MP4_PROBE = os.environ.get('MP4_PROBE', 'true').lower() == 'true'
+MP4_PROBE_BYTES = 16384
+
+# One ticker reports progress for every transfer, batched into a single Socket.IO message
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', 1.0))
+
+# Reconnects after an upstream failure mid-stream, on the same URL first and then other services
+STREAM_MAX_FAILOVERS = int(os.environ.get('STREAM_MAX_FAILOVERS', 3))
+
+# Background download jobs: fetched to disk at full speed, collected by the client later
+JOB_DIR = os.environ.get('JOB_DIR', os.path.join(tempfile.gettempdir(), 'tiktok_jobs'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', 100))
+JOB_TTL = int(os.environ.get('JOB_TTL', 1800))  # seconds a finished file is kept
+JOB_MAX_FILE_MB = int(os.environ.get('JOB_MAX_FILE_MB', 500))
+JOB_MAX_DISK_MB = int(os.environ.get('JOB_MAX_DISK_MB', 2048))  # all job files together
+JOB_CHUNK_SIZE = 1048576
+JOB_CLEANUP_INTERVAL = 60
+last_job_cleanup = 0
+
+# Admission control for concurrent upstream streams
+MAX_CONCURRENT_STREAMS = int(os.environ.get('MAX_CONCURRENT_STREAMS', 20))
+MAX_QUEUED_STREAMS = int(os.environ.get('MAX_QUEUED_STREAMS', 50))
+STREAM_QUEUE_TIMEOUT = int(os.environ.get('STREAM_QUEUE_TIMEOUT', 120))
+
+# Per-client rate limits as "requests/seconds"
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_EXTRACTION = os.environ.get('RATE_LIMIT_EXTRACTION', '20/60')
+RATE_LIMIT_STREAMING = os.environ.get('RATE_LIMIT_STREAMING', '30/60')
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL')
+RATE_LIMIT_API_KEYS = set(os.environ.get('RATE_LIMIT_API_KEYS', '').split(',')) - {''}
+# Proxies in front of the app that append to X-Forwarded-For (1 on Render); 0 ignores the header
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+
+# Shared CDN session so probe and stream reuse the same warm connections
+cdn_session = requests.Session()
+cdn_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=20, pool_maxsize=50))
+cdn_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=20, pool_maxsize=50))
+
+# Prometheus metrics exposed on /api/metrics
+EXTRACTION_LATENCY = Histogram('tiktok_extraction_duration_seconds', 'Time spent in each extraction service', ['service'])
+EXTRACTION_SUCCESS = Counter('tiktok_extraction_success_total', 'Successful extractions by service', ['service'])
+EXTRACTION_FAILURE = Counter('tiktok_extraction_failure_total', 'Failed extractions by service and reason', ['service', 'reason'])
+STREAM_TTFB = Histogram('tiktok_stream_first_byte_seconds', 'Time from stream start to the first byte sent to the client',
+                        buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+STREAM_BYTES = Counter('tiktok_stream_bytes_total', 'Bytes streamed to clients by perform_streaming')
+STREAM_RESULTS = Counter('tiktok_streams_total', 'Finished streams by status', ['status'])
+ACTIVE_STREAMS = Gauge('tiktok_active_streams', 'Streams currently being proxied')
+SOCKETIO_EMITS = Counter('tiktok_socketio_emits_total', 'Socket.IO messages emitted by event', ['event'])
+RATE_LIMITED = Counter('tiktok_rate_limited_total', 'Requests rejected by the per-client rate limiter', ['budget'])
+QUEUED_STREAMS = Gauge('tiktok_queued_streams', 'Streams waiting for an admission slot')
+STREAM_REJECTIONS = Counter('tiktok_stream_rejections_total', 'Streams turned away by admission control', ['reason'])
+THUMBNAIL_REQUESTS = Counter('tiktok_thumbnail_requests_total', 'Thumbnail requests by cache result', ['result'])
+URL_CACHE_LOOKUPS = Counter('tiktok_url_cache_lookups_total', 'Video info cache lookups by result', ['result'])
+URL_CACHE_REFRESHES = Counter('tiktok_url_cache_refreshes_total', 'Background refreshes of hot cached video info')
+STREAM_REDIRECTS = Counter('tiktok_stream_redirects_total', 'Streams handed to the client as a CDN redirect', ['service'])
+REDIRECT_PROBES = Counter('tiktok_redirect_probes_total', 'Header-less direct URL checks by service and result', ['service', 'result'])
+JOB_RESULTS = Counter('tiktok_jobs_total', 'Finished background download jobs by status', ['status'])
+ACTIVE_JOBS = Gauge('tiktok_active_jobs', 'Background download jobs currently transferring')
+PROGRESS_BATCH_SIZE = Histogram('tiktok_progress_batch_size', 'Progress frames per batched Socket.IO message',
+                                buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+PROFILE_VIDEOS = Counter('tiktok_profile_videos_total', 'Videos seen by profile harvests by result', ['result'])
+MEDIA_PROBES = Counter('tiktok_media_probes_total', 'MP4 header metadata probes by result', ['result'])
+FASTSTART_CHECKS = Counter('tiktok_faststart_checks_total', 'Faststart checks of proxied MP4s by result', ['result'])
+STREAM_FAILOVERS = Counter('tiktok_stream_failovers_total', 'Mid-stream reconnects by service and outcome', ['service', 'outcome'])
+
+def load_yt_dlp():
+    """Import yt-dlp on first use; it is only the last extraction fallback"""
+    global yt_dlp
+    if yt_dlp is None:
+        started = time.time()
+        import yt_dlp as module
+        yt_dlp = module
+        logger.info(f"Loaded yt-dlp in {time.time() - started:.2f}s")
+    return yt_dlp
+
+def _prewarm():
+    try:
+        load_yt_dlp()
+    except Exception as e:
+        logger.warning(f"yt-dlp prewarm failed: {str(e)}")
+
+def start_prewarm():
+    """Load heavy modules in the background shortly after the first request"""
+    global _prewarm_started
+    if not _prewarm_started:
+        _prewarm_started = True
+        if extractor.tiktok_extractor._service_enabled('yt-dlp') and PREWARM_DELAY >= 0:
+            eventlet.spawn_after(PREWARM_DELAY, _prewarm)
+
+def _failure_reason(error):
+    """Classify an extraction error message into a metric label"""
+    message = str(error).lower()
+    if 'timed out' in message or 'timeout' in message:
+        return 'timeout'
+    if 'connection' in message or 'resolve' in message:
+        return 'connection'
+    if 'http' in message or re.search(r'\b[45]\d\d\b', message):
+        return 'http_error'
+    if 'not found' in message or 'no video' in message or 'no playable' in message:
+        return 'no_url'
+    if 'json' in message or 'expecting value' in message or 'api returned error' in message:
+        return 'bad_response'
+    return 'error'
+
+def record_extraction(service_name, started, error=None):
+    """Record latency and outcome of one extraction service attempt"""
+    EXTRACTION_LATENCY.labels(service_name).observe(time.time() - started)
+    if error is None:
+        EXTRACTION_SUCCESS.labels(service_name).inc()
+    else:
+        EXTRACTION_FAILURE.labels(service_name, _failure_reason(error)).inc()
+
+def socket_emit(event, data=None):
+    """Broadcast a Socket.IO event and count it"""
+    SOCKETIO_EMITS.labels(event).inc()
+    if data is None:
+        socketio.emit(event)
+    else:
+        socketio.emit(event, data)
+
+def client_emit(event, data):
+    """Emit a Socket.IO event to the requesting client and count it"""
+    SOCKETIO_EMITS.labels(event).inc()
+    emit(event, data)
+
+def _env_list(name, default):
+    """Read a comma-separated list from the environment"""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+class DownloadTrace:
+    """Timeline of the phases of a single download"""
+    
+    def __init__(self, download_id=None):
+        self.download_id = download_id
+        self.started = time.time()
+        self.events = []
+        self.status = None
+    
+    def add(self, phase, started, ended=None, outcome='ok', **details):
+        """Record a phase that ran from started to ended (both epoch seconds)"""
+        event = {
+            'phase': phase,
+            'start': round(started - self.started, 4),
+            'end': round((ended if ended is not None else started) - self.started, 4),
+            'outcome': outcome,
+        }
+        if details:
+            event.update(details)
+        self.events.append(event)
+        return event
+    
+    def mark(self, phase, **details):
+        """Record an instantaneous event"""
+        return self.add(phase, time.time(), **details)
+    
+    @contextmanager
+    def span(self, phase, **details):
+        """Record a phase around a block, marking it failed if the block raises"""
+        started = time.time()
+        try:
+            yield details
+        except Exception as e:
+            self.add(phase, started, time.time(), 'error', error=str(e)[:200], **details)
+            raise
+        else:
+            self.add(phase, started, time.time(), details.pop('outcome', 'ok'), **details)
+    
+    def finish(self, status):
+        """Close the trace and log it as one structured line"""
+        if self.status is not None:
+            return
+        self.status = status
+        logger.info(f"download_trace {json.dumps(self.to_dict(), separators=(',', ':'))}")
+    
+    def to_dict(self):
+        return {
+            'download_id': self.download_id,
+            'started_at': datetime.fromtimestamp(self.started).isoformat(),
+            'status': self.status,
+            'duration': round(time.time() - self.started, 4),
+            'events': self.events
+        }
+
+# Trace of the download the current green thread is working on
+_trace_context = threading.local()
+
+def current_trace():
+    """Return the trace of the download being processed, if any"""
+    return getattr(_trace_context, 'trace', None)
+
+@contextmanager
+def tracing(trace):
+    """Make a trace current for extraction code running in this green thread"""
+    previous = current_trace()
+    _trace_context.trace = trace
+    try:
+        yield trace
+    finally:
+        _trace_context.trace = previous
+
+@contextmanager
+def trace_span(phase, **details):
+    """Record a span on the current trace, or do nothing when untraced"""
+    trace = current_trace()
+    if trace is None:
+        yield details
+    else:
+        with trace.span(phase, **details) as span_details:
+            yield span_details
+
+def public_download(download):
+    """Download record without internal fields, for API and Socket.IO payloads"""
+    return download.to_dict()
+
+def downloads_page(args):
+    """Page of download records for a request's limit/cursor/status arguments
+    
+    Raises ValueError for malformed arguments.
+    """
+    limit = min(int(args.get('limit') or DOWNLOADS_PAGE_SIZE), DOWNLOADS_MAX_PAGE_SIZE)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    cursor = args.get('cursor')
+    cursor = int(cursor) if cursor else None
+    statuses = {s.strip() for s in (args.get('status') or '').split(',') if s.strip()}
+    records, next_cursor = active_downloads.page(limit, cursor, statuses)
+    return [public_download(d) for d in records], (str(next_cursor) if next_cursor else None)
+
+def downloads_delta(since):
+    """downloads_delta payload with the changes after version since"""
+    reset, added, updated, removed = active_downloads.changes(since, DOWNLOADS_PAGE_SIZE)
+    return {
+        'version': active_downloads.version,
+        'since': since,
+        'reset': reset,
+        'added': [public_download(d) for d in added],
+        'updated': [public_download(d) for d in updated],
+        'removed': removed
+    }
+
+def _run_delta_sync():
+    """Broadcast what changed since the previous broadcast, when anything did"""
+    version = active_downloads.version
+    while True:
+        eventlet.sleep(DELTA_SYNC_INTERVAL)
+        if active_downloads.version != version:
+            delta = downloads_delta(version)
+            socket_emit('downloads_delta', delta)
+            version = delta['version']
+
+def start_delta_sync():
+    """Start the delta broadcaster once the first dashboard connects"""
+    global delta_sync_thread
+    if delta_sync_thread is None:
+        delta_sync_thread = eventlet.spawn(_run_delta_sync)
+
+# Link patterns used by the HTML response parsers
+TIKMATE_LINK_PATTERNS = [
+    re.compile(r'href="([^"]*\.mp4[^"]*)"', re.IGNORECASE),
+    re.compile(r'href="([^"]*)"[^>]*>.*?Download.*?MP4', re.IGNORECASE),
+    re.compile(r'href="([^"]*)"[^>]*>.*?Download.*?Without.*?Watermark', re.IGNORECASE),
+]
+SNAPTIK_LINK_PATTERNS = [
+    re.compile(r'href="([^"]+)"[^>]*>.*?Download MP4', re.IGNORECASE | re.DOTALL),
+    re.compile(r'<a[^>]+href="([^"]+)"[^>]*class="[^"]*download[^"]*"', re.IGNORECASE | re.DOTALL),
+    re.compile(r'download-link"[^>]*href="([^"]+)"', re.IGNORECASE | re.DOTALL),
+]
+SSSTIK_LINK_PATTERNS = [
+    re.compile(r'href="([^"]+)"[^>]*>.*?Download Without Watermark', re.IGNORECASE | re.DOTALL),
+    re.compile(r'href="([^"]+)"[^>]*>.*?Download MP4', re.IGNORECASE | re.DOTALL),
+    re.compile(r'<a[^>]+href="([^"]+)"[^>]*class="[^"]*download[^"]*"', re.IGNORECASE | re.DOTALL),
+]
+SSSTIK_HD_PATTERNS = [
+    re.compile(r'<a[^>]+href="([^"]+)"[^>]*class="[^"]*without_watermark_hd[^"]*"', re.IGNORECASE | re.DOTALL),
+    re.compile(r'href="([^"]+)"[^>]*>.*?Download Without Watermark HD', re.IGNORECASE | re.DOTALL),
+]
+SSSTIK_AUDIO_PATTERNS = [
+    re.compile(r'<a[^>]+href="([^"]+)"[^>]*class="[^"]*\bmusic\b[^"]*"', re.IGNORECASE | re.DOTALL),
+    re.compile(r'href="([^"]+)"[^>]*>\s*Download MP3', re.IGNORECASE | re.DOTALL),
+]
+HTML_TITLE_PATTERN = re.compile(r'<title>([^<]+)</title>')
+SSSTIK_TITLE_PATTERN = re.compile(r'<p[^>]*class="[^"]*maintext[^"]*"[^>]*>([^<]+)</p>')
+
+# Download modes, and the services able to return an audio-only URL
+DOWNLOAD_MODES = ('video', 'audio')
+AUDIO_SERVICES = ('SSSTik', 'TikWM', 'yt-dlp')
+# Quality options; providers with a single encode ignore them
+QUALITY_SERVICES = ('SSSTik', 'TikWM', 'yt-dlp')
+QUALITY_HEIGHTS = {'sd': 540, 'hd': 1080, 'max': None}
+
+def parse_quality(value):
+    """Normalise a quality option to 'sd', 'hd', 'max' or a max height like '480p'
+    
+    None keeps each provider's default encode. Raises ValueError for anything else.
+    """
+    if value is None or str(value).strip() == '':
+        return None
+    value = str(value).strip().lower()
+    if value in QUALITY_HEIGHTS:
+        return value
+    match = re.fullmatch(r'(\d{3,4})p?', value)
+    if not match:
+        raise ValueError(f"quality must be sd, hd, max or a height such as 720p, not {value!r}")
+    return f"{int(match.group(1))}p"
+
+def quality_height(quality):
+    """Maximum height for a normalised quality, or None for no limit"""
+    if quality in QUALITY_HEIGHTS:
+        return QUALITY_HEIGHTS[quality]
+    return int(quality[:-1])
+
+def wants_hd(quality):
+    """True when a quality asks for a provider's HD encode rather than its standard one"""
+    height = quality_height(quality)
+    return height is None or height >= QUALITY_HEIGHTS['hd']
+
+AUDIO_MIMETYPES = {'mp3': 'audio/mpeg', 'm4a': 'audio/mp4', 'mp4': 'audio/mp4', 'aac': 'audio/aac', 'webm': 'audio/webm'}
 
 class TikTokExtractor:
     """Enhanced TikTok extractor with multiple working services"""
@@ -65,43 +473,101 @@ class TikTokExtractor:
             'Mozilla/5.0 (Linux; Android 12; SM-G998B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/105.0.0.0 Mobile Safari/537.36',
             'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36',
         ]
+        
+        # Service endpoints, overridable to point at local stand-ins for load testing
+        self.tikmate_domains = _env_list('TIKMATE_DOMAINS', [
+            'https://tikmate.cc',
+            'https://tikmate.online',
+            'https://tikmate.app'
+        ])
+        self.snaptik_url = os.environ.get('SNAPTIK_URL', 'https://snaptik.app')
+        self.ssstik_url = os.environ.get('SSSTIK_URL', 'https://ssstik.io')
+        self.tikwm_api_url = os.environ.get('TIKWM_API_URL', 'https://www.tikwm.com/api/')
+        self.tikfast_api_url = os.environ.get('TIKFAST_API_URL', 'https://tikfast.org/api/download')
+        
+        # Optional allow-list of service names, e.g. "TikMate,TikWM"
+        self.enabled_services = _env_list('EXTRACTION_SERVICES', None)
 
-    def extract_tiktok_video(self, url):
+    def _service_enabled(self, service_name):
+        """Check a service against the EXTRACTION_SERVICES allow-list"""
+        return self.enabled_services is None or service_name in self.enabled_services
+
+    def _as_audio(self, result, audio_url, ext='mp3'):
+        """Turn a parsed video result into an audio-only one"""
+        if audio_url.startswith('//'):
+            audio_url = 'https:' + audio_url
+        result.update({
+            'direct_url': audio_url,
+            'filename': re.sub(r'\.mp4$', f'.{ext}', result['filename']),
+            'filesize': None,
+            'mode': 'audio',
+            'mimetype': AUDIO_MIMETYPES.get(ext, 'application/octet-stream'),
+        })
+        return result
+
+    def extract_tiktok_video(self, url, mode='video', quality=None):
         """Main TikTok extraction with enhanced services"""
-        url = self._clean_tiktok_url(url)
+        for result in self.iter_candidates(url, mode=mode, quality=quality):
+            return result
+        if mode == 'audio':
+            raise Exception("No audio-only source was found for this TikTok video.")
+        raise Exception("All download methods failed. The TikTok video may be private, region-restricted, or temporarily unavailable.")
+
+    def iter_candidates(self, url, skip=(), mode='video', quality=None):
+        """Yield a result from each working service in order of reliability
+
+        Services are only tried as the caller asks for the next candidate, so
+        the first success costs the same as before and the rest of the chain
+        stays available for failover. Each result is tagged with its service.
+        In audio mode only services that expose the soundtrack are tried, and
+        a quality is passed to the services that offer more than one encode.
+        """
+        if mode == 'audio':
+            quality = None
+        with trace_span('clean_url'):
+            url = self._clean_tiktok_url(url)
         logger.info(f"Processing TikTok URL: {url}")
         
-        # Try multiple services in order of reliability
+        # Try multiple services in order of reliability, yt-dlp last
         services = [
             ("TikMate", self._extract_with_tikmate),
             ("SnapTik", self._extract_with_snaptik),
             ("SSSTik", self._extract_with_ssstik),
             ("TikWM", self._extract_with_tikwm),
             ("TikFast", self._extract_with_tikfast),
+            ("yt-dlp", self._extract_with_ytdlp),
         ]
         
         for service_name, extract_func in services:
+            if service_name in skip or not self._service_enabled(service_name):
+                continue
+            if mode == 'audio' and service_name not in AUDIO_SERVICES:
+                continue
+            options = {}
+            if mode != 'video':
+                options['mode'] = mode
+            if quality and service_name in QUALITY_SERVICES:
+                options['quality'] = quality
+            started = time.time()
             try:
                 logger.info(f"Trying {service_name}...")
-                result = extract_func(url)
-                if result and result.get('direct_url'):
-                    logger.info(f"✅ Success with {service_name}")
-                    return result
+                with trace_span('service', service=service_name) as span:
+                    result = extract_func(url, **options)
+                    if not (result and result.get('direct_url')):
+                        span['outcome'] = 'no_url'
+                if not (result and result.get('direct_url')):
+                    record_extraction(service_name, started, "No video URL returned")
+                    continue
+                record_extraction(service_name, started)
+                logger.info(f"✅ Success with {service_name}")
             except Exception as e:
+                record_extraction(service_name, started, e)
                 logger.warning(f"❌ {service_name} failed: {str(e)}")
                 continue
-        
-        # Final fallback to yt-dlp
-        try:
-            logger.info("Trying yt-dlp as final fallback...")
-            result = self._extract_with_ytdlp(url)
-            if result and result.get('direct_url'):
-                logger.info("✅ Success with yt-dlp")
-                return result
-        except Exception as e:
-            logger.warning(f"❌ yt-dlp failed: {str(e)}")
-        
-        raise Exception("All download methods failed. The TikTok video may be private, region-restricted, or temporarily unavailable.")
+            result['service'] = service_name
+            if quality:
+                result['quality'] = quality
+            yield result
 
     def _extract_with_tikmate(self, url):
         """Extract using TikMate service"""
@@ -118,64 +584,18 @@ class TikTokExtractor:
             }
             
             # Try multiple TikMate domains
-            domains = [
-                'https://tikmate.cc',
-                'https://tikmate.online', 
-                'https://tikmate.app'
-            ]
+            domains = self.tikmate_domains
             
             for domain in domains:
                 try:
                     data = {'url': url}
-                    response = session.post(f'{domain}/download', data=data, headers=headers, timeout=30)
-                    response.raise_for_status()
-                    
-                    # Try to find download link in response
-                    download_url = None
-                    title = f"TikTok_Video_{self._extract_video_id(url)}"
-                    
-                    # Check for JSON response
-                    try:
-                        result = response.json()
-                        if result.get('success'):
-                            download_url = result.get('url')
-                            title = result.get('title', title)
-                    except:
-                        # Parse HTML response
-                        patterns = [
-                            r'href="([^"]*\.mp4[^"]*)"',
-                            r'href="([^"]*)"[^>]*>.*?Download.*?MP4',
-                            r'href="([^"]*)"[^>]*>.*?Download.*?Without.*?Watermark',
-                        ]
-                        
-                        for pattern in patterns:
-                            match = re.search(pattern, response.text, re.IGNORECASE)
-                            if match:
-                                download_url = match.group(1)
-                                break
+                    with trace_span('tikmate_domain', domain=domain):
+                        response = session.post(f'{domain}/download', data=data, headers=headers, timeout=30)
+                        response.raise_for_status()
                     
-                    if download_url:
-                        # Fix URL formatting
-                        if download_url.startswith('//'):
-                            download_url = 'https:' + download_url
-                        elif download_url.startswith('/'):
-                            download_url = domain + download_url
-                        
-                        return {
-                            'direct_url': download_url,
-                            'title': title,
-                            'filename': f"TikTok_TikMate_{self._clean_filename(title)}.mp4",
-                            'filesize': None,
-                            'duration': None,
-                            'platform': 'tiktok',
-                            'headers': {
-                                'User-Agent': random.choice(self.user_agents),
-                                'Referer': domain + '/',
-                            },
-                            'thumbnail': None,
-                            'uploader': 'unknown',
-                            'view_count': 0
-                        }
+                    result = self._parse_tikmate_response(response.text, url, domain)
+                    if result:
+                        return result
                         
                 except Exception as e:
                     logger.warning(f"TikMate domain {domain} failed: {str(e)}")
@@ -186,6 +606,50 @@ class TikTokExtractor:
         except Exception as e:
             raise Exception(f"TikMate extraction failed: {str(e)}")
 
+    def _parse_tikmate_response(self, text, url, domain):
+        """Parse a TikMate JSON or HTML response, returning None if it has no link"""
+        download_url = None
+        title = f"TikTok_Video_{self._extract_video_id(url)}"
+        
+        # Check for JSON response
+        try:
+            result = json.loads(text)
+            if result.get('success'):
+                download_url = result.get('url')
+                title = result.get('title', title)
+        except (ValueError, AttributeError):
+            # Parse HTML response
+            for pattern in TIKMATE_LINK_PATTERNS:
+                match = pattern.search(text)
+                if match:
+                    download_url = match.group(1)
+                    break
+        
+        if not download_url:
+            return None
+        
+        # Fix URL formatting
+        if download_url.startswith('//'):
+            download_url = 'https:' + download_url
+        elif download_url.startswith('/'):
+            download_url = domain + download_url
+        
+        return {
+            'direct_url': download_url,
+            'title': title,
+            'filename': f"TikTok_TikMate_{self._clean_filename(title)}.mp4",
+            'filesize': None,
+            'duration': None,
+            'platform': 'tiktok',
+            'headers': {
+                'User-Agent': random.choice(self.user_agents),
+                'Referer': domain + '/',
+            },
+            'thumbnail': None,
+            'uploader': 'unknown',
+            'view_count': 0
+        }
+
     def _extract_with_snaptik(self, url):
         """Extract using SnapTik service"""
         try:
@@ -198,7 +662,7 @@ class TikTokExtractor:
             }
             
             # Use SnapTik
-            response = session.get('https://snaptik.app/', headers=headers, timeout=30)
+            response = session.get(f'{self.snaptik_url}/', headers=headers, timeout=30)
             response.raise_for_status()
             
             # Submit the URL
@@ -206,47 +670,44 @@ class TikTokExtractor:
                 'url': url
             }
             
-            response = session.post('https://snaptik.app/abc', data=form_data, headers=headers, timeout=30)
+            response = session.post(f'{self.snaptik_url}/abc', data=form_data, headers=headers, timeout=30)
             response.raise_for_status()
             
-            # Look for download link
-            patterns = [
-                r'href="([^"]+)"[^>]*>.*?Download MP4',
-                r'<a[^>]+href="([^"]+)"[^>]*class="[^"]*download[^"]*"',
-                r'download-link"[^>]*href="([^"]+)"',
-            ]
-            
-            for pattern in patterns:
-                match = re.search(pattern, response.text, re.IGNORECASE | re.DOTALL)
-                if match:
-                    download_url = match.group(1)
-                    
-                    # Extract title
-                    title_match = re.search(r'<title>([^<]+)</title>', response.text)
-                    title = title_match.group(1) if title_match else f"TikTok_Video_{self._extract_video_id(url)}"
-                    
-                    return {
-                        'direct_url': download_url,
-                        'title': title,
-                        'filename': f"TikTok_SnapTik_{self._clean_filename(title)}.mp4",
-                        'filesize': None,
-                        'duration': None,
-                        'platform': 'tiktok',
-                        'headers': {
-                            'User-Agent': random.choice(self.user_agents),
-                            'Referer': 'https://snaptik.app/',
-                        },
-                        'thumbnail': None,
-                        'uploader': 'unknown',
-                        'view_count': 0
-                    }
-            
-            raise Exception("Download link not found")
+            return self._parse_snaptik_response(response.text, url)
             
         except Exception as e:
             raise Exception(f"SnapTik failed: {str(e)}")
 
-    def _extract_with_ssstik(self, url):
+    def _parse_snaptik_response(self, html, url):
+        """Parse the SnapTik result page"""
+        for pattern in SNAPTIK_LINK_PATTERNS:
+            match = pattern.search(html)
+            if match:
+                download_url = match.group(1)
+                
+                # Extract title
+                title_match = HTML_TITLE_PATTERN.search(html)
+                title = title_match.group(1) if title_match else f"TikTok_Video_{self._extract_video_id(url)}"
+                
+                return {
+                    'direct_url': download_url,
+                    'title': title,
+                    'filename': f"TikTok_SnapTik_{self._clean_filename(title)}.mp4",
+                    'filesize': None,
+                    'duration': None,
+                    'platform': 'tiktok',
+                    'headers': {
+                        'User-Agent': random.choice(self.user_agents),
+                        'Referer': f'{self.snaptik_url}/',
+                    },
+                    'thumbnail': None,
+                    'uploader': 'unknown',
+                    'view_count': 0
+                }
+        
+        raise Exception("Download link not found")
+
+    def _extract_with_ssstik(self, url, mode='video', quality=None):
         """Extract using SSSTik alternative method"""
         try:
             session = requests.Session()
@@ -258,7 +719,7 @@ class TikTokExtractor:
             }
             
             # Use alternative SSSTik domain
-            response = session.get('https://ssstik.io', headers=headers, timeout=30)
+            response = session.get(self.ssstik_url, headers=headers, timeout=30)
             response.raise_for_status()
             
             # Look for the download form and submit directly
@@ -268,47 +729,52 @@ class TikTokExtractor:
                 'tt': ''  # Token might not be required
             }
             
-            response = session.post('https://ssstik.io/abc', data=form_data, headers=headers, timeout=30)
+            response = session.post(f'{self.ssstik_url}/abc', data=form_data, headers=headers, timeout=30)
             response.raise_for_status()
             
-            # Try to find download link with multiple patterns
-            patterns = [
-                r'href="([^"]+)"[^>]*>.*?Download Without Watermark',
-                r'href="([^"]+)"[^>]*>.*?Download MP4',
-                r'<a[^>]+href="([^"]+)"[^>]*class="[^"]*download[^"]*"',
-            ]
-            
-            for pattern in patterns:
-                match = re.search(pattern, response.text, re.IGNORECASE | re.DOTALL)
-                if match:
-                    download_url = match.group(1)
-                    
-                    # Extract title
-                    title_match = re.search(r'<p[^>]*class="[^"]*maintext[^"]*"[^>]*>([^<]+)</p>', response.text)
-                    title = title_match.group(1) if title_match else f"TikTok_Video_{self._extract_video_id(url)}"
-                    
-                    return {
-                        'direct_url': download_url,
-                        'title': title,
-                        'filename': f"TikTok_SSSTik_{self._clean_filename(title)}.mp4",
-                        'filesize': None,
-                        'duration': None,
-                        'platform': 'tiktok',
-                        'headers': {
-                            'User-Agent': random.choice(self.user_agents),
-                            'Referer': 'https://ssstik.io/',
-                        },
-                        'thumbnail': None,
-                        'uploader': 'unknown',
-                        'view_count': 0
-                    }
-            
-            raise Exception("Download link not found")
+            return self._parse_ssstik_response(response.text, url, mode, quality)
             
         except Exception as e:
             raise Exception(f"SSSTik failed: {str(e)}")
 
-    def _extract_with_tikwm(self, url):
+    def _parse_ssstik_response(self, html, url, mode='video', quality=None):
+        """Parse the SSSTik result fragment"""
+        if mode == 'audio':
+            patterns = SSSTIK_AUDIO_PATTERNS
+        elif quality and wants_hd(quality):
+            # Fall back to the standard link when there is no HD one
+            patterns = SSSTIK_HD_PATTERNS + SSSTIK_LINK_PATTERNS
+        else:
+            patterns = SSSTIK_LINK_PATTERNS
+        for pattern in patterns:
+            match = pattern.search(html)
+            if match:
+                download_url = match.group(1)
+                
+                # Extract title
+                title_match = SSSTIK_TITLE_PATTERN.search(html)
+                title = title_match.group(1) if title_match else f"TikTok_Video_{self._extract_video_id(url)}"
+                
+                result = {
+                    'direct_url': download_url,
+                    'title': title,
+                    'filename': f"TikTok_SSSTik_{self._clean_filename(title)}.mp4",
+                    'filesize': None,
+                    'duration': None,
+                    'platform': 'tiktok',
+                    'headers': {
+                        'User-Agent': random.choice(self.user_agents),
+                        'Referer': f'{self.ssstik_url}/',
+                    },
+                    'thumbnail': None,
+                    'uploader': 'unknown',
+                    'view_count': 0
+                }
+                return self._as_audio(result, download_url) if mode == 'audio' else result
+        
+        raise Exception("Download link not found")
+
+    def _extract_with_tikwm(self, url, mode='video', quality=None):
         """Extract using TikWM API"""
         try:
             session = requests.Session()
@@ -325,45 +791,57 @@ class TikTokExtractor:
                 'hd': 1
             }
             
-            response = session.post('https://www.tikwm.com/api/', data=data, headers=headers, timeout=30)
+            response = session.post(self.tikwm_api_url, data=data, headers=headers, timeout=30)
             response.raise_for_status()
             
-            result = response.json()
-            
-            if result.get('code') != 0:
-                raise Exception("API returned error")
-            
-            data = result.get('data', {})
-            video_url = data.get('hdplay') or data.get('play')
-            
-            if not video_url:
-                raise Exception("No video URL found")
-            
-            # Fix URL if it's relative
-            if video_url.startswith('//'):
-                video_url = 'https:' + video_url
-            
-            title = data.get('title', f'TikTok_Video_{self._extract_video_id(url)}')
-            
-            return {
-                'direct_url': video_url,
-                'title': title,
-                'filename': f"TikTok_TikWM_{self._clean_filename(title)}.mp4",
-                'filesize': None,
-                'duration': data.get('duration'),
-                'platform': 'tiktok',
-                'headers': {
-                    'User-Agent': random.choice(self.user_agents),
-                    'Referer': 'https://www.tiktok.com/',
-                },
-                'thumbnail': data.get('cover'),
-                'uploader': data.get('author', {}).get('unique_id', 'unknown'),
-                'view_count': data.get('play_count', 0)
-            }
+            return self._parse_tikwm_response(response.text, url, mode, quality)
             
         except Exception as e:
             raise Exception(f"TikWM failed: {str(e)}")
 
+    def _parse_tikwm_response(self, text, url, mode='video', quality=None):
+        """Parse a TikWM API JSON response"""
+        result = json.loads(text)
+        
+        if result.get('code') != 0:
+            raise Exception("API returned error")
+        
+        data = result.get('data', {})
+        if mode == 'audio':
+            video_url = data.get('music') or (data.get('music_info') or {}).get('play')
+            if not video_url:
+                raise Exception("No music URL found")
+        elif quality and not wants_hd(quality):
+            video_url = data.get('play') or data.get('hdplay')
+        else:
+            video_url = data.get('hdplay') or data.get('play')
+        
+        if not video_url:
+            raise Exception("No video URL found")
+        
+        # Fix URL if it's relative
+        if video_url.startswith('//'):
+            video_url = 'https:' + video_url
+        
+        title = data.get('title', f'TikTok_Video_{self._extract_video_id(url)}')
+        
+        result = {
+            'direct_url': video_url,
+            'title': title,
+            'filename': f"TikTok_TikWM_{self._clean_filename(title)}.mp4",
+            'filesize': None,
+            'duration': data.get('duration'),
+            'platform': 'tiktok',
+            'headers': {
+                'User-Agent': random.choice(self.user_agents),
+                'Referer': 'https://www.tiktok.com/',
+            },
+            'thumbnail': data.get('cover'),
+            'uploader': data.get('author', {}).get('unique_id', 'unknown'),
+            'view_count': data.get('play_count', 0)
+        }
+        return self._as_audio(result, video_url) if mode == 'audio' else result
+
     def _extract_with_tikfast(self, url):
         """Extract using TikFast API"""
         try:
@@ -381,48 +859,52 @@ class TikTokExtractor:
                 'url': url
             }
             
-            response = session.post('https://tikfast.org/api/download', json=data, headers=headers, timeout=30)
+            response = session.post(self.tikfast_api_url, json=data, headers=headers, timeout=30)
             response.raise_for_status()
             
-            result = response.json()
-            
-            if not result.get('success'):
-                raise Exception("API returned error")
-            
-            data = result.get('data', {})
-            video_url = data.get('video_url')
-            
-            if not video_url:
-                raise Exception("No video URL found")
-            
-            title = data.get('title', f'TikTok_Video_{self._extract_video_id(url)}')
-            
-            return {
-                'direct_url': video_url,
-                'title': title,
-                'filename': f"TikTok_TikFast_{self._clean_filename(title)}.mp4",
-                'filesize': None,
-                'duration': None,
-                'platform': 'tiktok',
-                'headers': {
-                    'User-Agent': random.choice(self.user_agents),
-                    'Referer': 'https://tikfast.org/',
-                },
-                'thumbnail': None,
-                'uploader': 'unknown',
-                'view_count': 0
-            }
+            return self._parse_tikfast_response(response.text, url)
             
         except Exception as e:
             raise Exception(f"TikFast failed: {str(e)}")
 
-    def _extract_with_ytdlp(self, url):
+    def _parse_tikfast_response(self, text, url):
+        """Parse a TikFast API JSON response"""
+        result = json.loads(text)
+        
+        if not result.get('success'):
+            raise Exception("API returned error")
+        
+        data = result.get('data', {})
+        video_url = data.get('video_url')
+        
+        if not video_url:
+            raise Exception("No video URL found")
+        
+        title = data.get('title', f'TikTok_Video_{self._extract_video_id(url)}')
+        
+        return {
+            'direct_url': video_url,
+            'title': title,
+            'filename': f"TikTok_TikFast_{self._clean_filename(title)}.mp4",
+            'filesize': None,
+            'duration': None,
+            'platform': 'tiktok',
+            'headers': {
+                'User-Agent': random.choice(self.user_agents),
+                'Referer': 'https://tikfast.org/',
+            },
+            'thumbnail': None,
+            'uploader': 'unknown',
+            'view_count': 0
+        }
+
+    def _extract_with_ytdlp(self, url, mode='video', quality=None):
         """Extract using yt-dlp with proper TikTok configuration"""
         try:
             options = {
                 'quiet': True,
                 'no_warnings': True,
-                'format': 'best[height<=720]',
+                'format': self._ytdlp_format(mode, quality),
                 'nocheckcertificate': True,
                 'extract_flat': False,
                 'http_headers': {
@@ -443,61 +925,87 @@ class TikTokExtractor:
                 },
             }
             
-            with yt_dlp.YoutubeDL(options) as ydl:
+            with load_yt_dlp().YoutubeDL(options) as ydl:
                 info = ydl.extract_info(url, download=False)
-                
-                if not info:
-                    raise Exception("No video info extracted")
-                
-                # Get the best available video URL
-                direct_url = info.get('url')
-                if not direct_url and 'formats' in info:
-                    # Try to find the best format
-                    formats = info['formats']
-                    video_formats = [f for f in formats if f.get('vcodec') != 'none']
-                    if video_formats:
-                        # Prefer formats with both video and audio
-                        best_format = None
-                        for fmt in video_formats:
-                            if fmt.get('acodec') != 'none':
-                                best_format = fmt
-                                break
-                        if not best_format and video_formats:
-                            best_format = video_formats[0]
-                        
-                        if best_format:
-                            direct_url = best_format['url']
-                
-                if not direct_url:
-                    raise Exception("No playable video URL found")
-                
-                title = info.get('title', f'TikTok_Video_{self._extract_video_id(url)}')
-                
-                return {
-                    'direct_url': direct_url,
-                    'title': title,
-                    'filename': f"TikTok_ytdlp_{self._clean_filename(title)}.mp4",
-                    'filesize': info.get('filesize'),
-                    'duration': info.get('duration'),
-                    'platform': 'tiktok',
-                    'headers': {
-                        'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1',
-                        'Referer': 'https://www.tiktok.com/',
-                        'Origin': 'https://www.tiktok.com',
-                        'Accept': '*/*',
-                        'Accept-Language': 'en-US,en;q=0.9',
-                        'Sec-Fetch-Dest': 'video',
-                        'Sec-Fetch-Mode': 'no-cors',
-                        'Sec-Fetch-Site': 'cross-site',
-                    },
-                    'thumbnail': info.get('thumbnail'),
-                    'uploader': info.get('uploader'),
-                    'view_count': info.get('view_count')
-                }
+                return self._parse_ytdlp_info(info, url, mode)
                 
         except Exception as e:
             raise Exception(f"yt-dlp failed: {str(e)}")
 
+    def _ytdlp_format(self, mode='video', quality=None):
+        """yt-dlp format selector for a mode and quality"""
+        if mode == 'audio':
+            return 'bestaudio[vcodec=none]'
+        if not quality:
+            return 'best[height<=720]'
+        height = quality_height(quality)
+        if height is None:
+            return 'best'
+        # The smallest encode is closer to the request than failing outright
+        return f'best[height<={height}]/worst'
+
+    def _parse_ytdlp_info(self, info, url, mode='video'):
+        """Pick a playable format from a yt-dlp info dict"""
+        if not info:
+            raise Exception("No video info extracted")
+        
+        if mode == 'audio':
+            # The format selector already picked an audio-only format, if there is one
+            if not info.get('url') or info.get('vcodec') not in (None, 'none'):
+                raise Exception("No audio-only format available")
+        
+        # Get the best available video URL
+        direct_url = info.get('url')
+        if not direct_url and 'formats' in info:
+            # Try to find the best format
+            formats = info['formats']
+            video_formats = [f for f in formats if f.get('vcodec') != 'none']
+            if video_formats:
+                # Prefer formats with both video and audio
+                best_format = None
+                for fmt in video_formats:
+                    if fmt.get('acodec') != 'none':
+                        best_format = fmt
+                        break
+                if not best_format and video_formats:
+                    best_format = video_formats[0]
+                
+                if best_format:
+                    direct_url = best_format['url']
+        
+        if not direct_url:
+            raise Exception("No playable video URL found")
+        
+        title = info.get('title', f'TikTok_Video_{self._extract_video_id(url)}')
+        
+        result = {
+            'direct_url': direct_url,
+            'title': title,
+            'filename': f"TikTok_ytdlp_{self._clean_filename(title)}.mp4",
+            'filesize': info.get('filesize'),
+            'duration': info.get('duration'),
+            'width': info.get('width'),
+            'height': info.get('height'),
+            'bitrate': int(info['tbr'] * 1000) if info.get('tbr') else None,
+            'platform': 'tiktok',
+            'headers': {
+                'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1',
+                'Referer': 'https://www.tiktok.com/',
+                'Origin': 'https://www.tiktok.com',
+                'Accept': '*/*',
+                'Accept-Language': 'en-US,en;q=0.9',
+                'Sec-Fetch-Dest': 'video',
+                'Sec-Fetch-Mode': 'no-cors',
+                'Sec-Fetch-Site': 'cross-site',
+            },
+            'thumbnail': info.get('thumbnail'),
+            'uploader': info.get('uploader'),
+            'view_count': info.get('view_count')
+        }
+        if mode == 'audio':
+            return self._as_audio(result, direct_url, info.get('ext') or 'm4a')
+        return result
+
     def _clean_tiktok_url(self, url):
         """Clean and standardize TikTok URL"""
         # Remove tracking parameters
@@ -547,16 +1055,21 @@ class TikTokVideoExtractor:
     def __init__(self):
         self.tiktok_extractor = TikTokExtractor()
     
-    def extract_direct_url(self, url):
+    def extract_direct_url(self, url, mode='video', quality=None):
         """Main extraction method"""
         platform = self.detect_platform(url)
         logger.info(f"Extracting from {platform}: {url}")
         
         if platform == 'tiktok':
-            return self.tiktok_extractor.extract_tiktok_video(url)
+            return self.tiktok_extractor.extract_tiktok_video(url, mode, quality)
         else:
             raise Exception("This tool only supports TikTok downloads. Please provide a TikTok URL.")
     
+    def iter_alternatives(self, url, skip=(), mode='video', quality=None):
+        """Yield further candidates from other services, for failover"""
+        if self.detect_platform(url) == 'tiktok':
+            yield from self.tiktok_extractor.iter_candidates(url, skip, mode, quality)
+    
     def detect_platform(self, url):
         """Detect platform"""
         domain = url.lower()
@@ -584,11 +1097,52 @@ def cleanup_old_downloads():
     
     if old_count > 0:
         logger.info(f"Cleaned up {old_count} old downloads")
+    
+    active_downloads.retire_finished()
+    
+    cleanup_prefetched()
+    cleanup_job_files()
+    
+    # A harvest is kept while any of its files can still be collected
+    pending = {id(entry['harvest']) for entry in harvest_files.values()}
+    for harvest_id, harvest in list(profile_harvests.items()):
+        if (harvest.get('finished') and time.time() - harvest['finished'] > PROFILE_HISTORY_TTL
+                and id(harvest) not in pending):
+            del profile_harvests[harvest_id]
 
-def perform_streaming(direct_url, video_info, download_id, filename):
-    """Core streaming logic with improved error handling"""
-    logger.info(f"Streaming from: {direct_url[:100]}...")
+def cleanup_job_files():
+    """Delete job files past their TTL or whose download record is gone"""
+    global last_job_cleanup
+    now = time.time()
+    if now - last_job_cleanup < JOB_CLEANUP_INTERVAL:
+        return
+    last_job_cleanup = now
+    
+    removed = 0
+    try:
+        entries = list(os.scandir(JOB_DIR))
+    except OSError:
+        return
+    for entry in entries:
+        download_id = entry.name.removesuffix('.part')
+        download = job_record(download_id)
+        if download is not None and download['status'] in ('queued', 'downloading'):
+            continue
+        try:
+            if download is None or now - entry.stat().st_mtime > JOB_TTL:
+                os.remove(entry.path)
+                removed += 1
+                if download is not None:
+                    download['status'] = 'expired'
+                expire_harvest_file(download_id)
+        except OSError:
+            continue
     
+    if removed:
+        logger.info(f"Removed {removed} expired job files")
+
+def build_stream_headers(video_info):
+    """Build request headers for fetching a direct URL from the TikTok CDN"""
     headers = video_info.get('headers', {}).copy()
     
     # Enhanced headers for TikTok CDN
@@ -605,132 +1159,1335 @@ def perform_streaming(direct_url, video_info, download_id, filename):
         'Accept-Language': 'en-US,en;q=0.9',
     })
     
-    # Handle range requests
-    range_header = request.headers.get('Range')
-    if range_header:
-        headers['Range'] = range_header
+    return headers
+
+def _prefetch_key(url, mode='video', quality=None):
+    """Cache key for a TikTok URL, download mode and quality, ignoring tracking parameters"""
+    key = re.sub(r'[?&].*$', '', url.strip())
+    if mode != 'video':
+        key = f"{key}#{mode}"
+    if quality:
+        key = f"{key}#{quality}"
+    return key
+
+def direct_url_expiry(direct_url):
+    """Unix time a signed CDN URL stops working, or None if it carries no expiry
+    
+    Understands TikTok's expire/x-expires, CloudFront style Expires and
+    S3 style X-Amz-Date plus X-Amz-Expires query parameters.
+    """
+    try:
+        params = {k.lower(): v for k, v in parse_qsl(urlsplit(direct_url).query)}
+    except ValueError:
+        return None
+    
+    if 'x-amz-date' in params and 'x-amz-expires' in params:
+        try:
+            signed = datetime.strptime(params['x-amz-date'], '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+            return signed.timestamp() + int(params['x-amz-expires'])
+        except ValueError:
+            return None
+    
+    for name in ('x-expires', 'expire', 'expires'):
+        value = params.get(name, '')
+        if value.isdigit():
+            expiry = int(value)
+            if expiry > 10 ** 12:  # milliseconds
+                expiry /= 1000
+            # Ignore values that are clearly not timestamps (e.g. relative seconds)
+            if expiry > 10 ** 9:
+                return expiry
+    return None
+
+def tiktok_video_id(url):
+    """Stable id for a video: the numeric TikTok id, or a hash of short links"""
+    match = re.search(r'/video/(\d+)', url)
+    if match:
+        return match.group(1)
+    return hashlib.sha1(_prefetch_key(url).encode('utf-8')).hexdigest()[:16]
+
+def register_thumbnail(url, video_info):
+    """Remember where a video's thumbnail lives and return its proxy URL"""
+    if not video_info.get('thumbnail'):
+        return None
+    video_id = tiktok_video_id(url)
+    thumbnail_sources.pop(video_id, None)
+    thumbnail_sources[video_id] = {
+        'url': video_info['thumbnail'],
+        'headers': video_info.get('headers', {})
+    }
+    while len(thumbnail_sources) > THUMBNAIL_MAX_SOURCES:
+        del thumbnail_sources[next(iter(thumbnail_sources))]
+    return f'/api/thumbnail/{video_id}'
+
+def cache_video_info(url, video_info, hits=0):
+    """Store video info until its direct URL is about to expire"""
+    mode = video_info.get('mode', 'video')
+    quality = video_info.get('quality')
+    key = _prefetch_key(url, mode, quality)
+    register_thumbnail(url, video_info)
+    now = time.time()
+    expiry = direct_url_expiry(video_info.get('direct_url', ''))
+    if expiry is None:
+        expires_at = now + PREFETCH_TTL
+    else:
+        expires_at = min(now + URL_CACHE_MAX_TTL, expiry - URL_EXPIRY_MARGIN)
+    
+    if expires_at <= now:
+        prefetched_videos.pop(key, None)
+        return
+    prefetched_videos[key] = {
+        'url': url,
+        'mode': mode,
+        'quality': quality,
+        'video_info': video_info,
+        'expires_at': expires_at,
+        'hits': hits
+    }
+    prefetched_videos.move_to_end(key)
+    while len(prefetched_videos) > URL_CACHE_MAX_ENTRIES:
+        prefetched_videos.popitem(last=False)
+
+def invalidate_video_info(url, mode='video', quality=None):
+    """Forget cached video info whose direct URL stopped working"""
+    if url:
+        prefetched_videos.pop(_prefetch_key(url, mode, quality), None)
+
+def _refresh_due(entry, now):
+    """True when a hot entry is close enough to expiry to refresh it"""
+    return entry['hits'] >= URL_REFRESH_MIN_HITS and entry['expires_at'] - now <= URL_REFRESH_AHEAD
+
+def refresh_video_info(entry):
+    """Re-extract a hot entry in the background while the old URL is still served"""
+    if _prefetch_key(entry['url'], entry['mode'], entry['quality']) in prefetch_jobs:
+        return
+    URL_CACHE_REFRESHES.inc()
+    logger.info(f"Refreshing cached video info for: {entry['url']}")
+    start_prefetch(entry['url'], hits=max(1, entry['hits'] // 2), mode=entry['mode'], quality=entry['quality'])
+
+def _content_range_total(content_range):
+    """Total size from a 'bytes 0-0/12345' Content-Range header"""
+    match = re.match(r'bytes\s+\d+-\d+/(\d+)', content_range or '')
+    return int(match.group(1)) if match else None
+
+def _content_range_start(content_range):
+    """First byte offset from a 'bytes 100-199/12345' Content-Range header"""
+    match = re.match(r'bytes\s+(\d+)-\d+/', content_range or '')
+    return int(match.group(1)) if match else None
+
+def _parse_range(range_header):
+    """Return (start, end) for a single 'bytes=N-' or 'bytes=N-M' range, else None"""
+    match = re.fullmatch(r'bytes=(\d+)-(\d*)', (range_header or '').strip())
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2)) if match.group(2) else None
+
+def probe_filesize(video_info):
+    """Probe a direct URL with HEAD, then a one-byte Range GET, and return its size
     
-    session = requests.Session()
+    Raises if the URL is not reachable, so this doubles as a liveness check
+    that warms the CDN connection.
+    """
+    direct_url = video_info['direct_url']
+    headers = build_stream_headers(video_info)
     
     try:
-        # Add retry logic for CDN issues
-        max_retries = 2
-        for attempt in range(max_retries + 1):
-            try:
-                response = session.get(
-                    direct_url,
-                    headers=headers,
-                    stream=True,
-                    timeout=(10, 30),
-                    allow_redirects=True,
-                    verify=False
-                )
-                
-                if response.status_code == 403:
-                    if attempt < max_retries:
-                        logger.warning(f"403 Forbidden, retrying... (attempt {attempt + 1})")
-                        time.sleep(1)
-                        continue
-                    else:
-                        raise Exception("Access forbidden after multiple attempts. The video may be protected or temporarily unavailable.")
-                
-                elif response.status_code == 404:
-                    raise Exception("Video not found. It may have been deleted.")
-                
-                elif response.status_code >= 400:
-                    raise Exception(f"HTTP {response.status_code}: {response.reason}")
-                
-                # If we get here, the request was successful
-                break
-                
-            except requests.exceptions.Timeout:
-                if attempt < max_retries:
-                    logger.warning(f"Timeout, retrying... (attempt {attempt + 1})")
-                    continue
-                else:
-                    raise Exception("Connection timeout after multiple attempts")
-        
-        total_size = int(response.headers.get('content-length', 0))
-        active_downloads[download_id].update({
-            'total_bytes': total_size,
-            'status': 'streaming'
+        response = cdn_session.head(direct_url, headers=headers, timeout=(5, 10), allow_redirects=True, verify=False)
+        response.close()
+        content_length = response.headers.get('content-length')
+        if response.status_code == 200 and content_length and int(content_length) > 0:
+            return int(content_length)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"HEAD probe failed: {str(e)}")
+    
+    # Some CDNs reject HEAD, so ask for a single byte instead
+    headers['Range'] = 'bytes=0-0'
+    response = cdn_session.get(direct_url, headers=headers, stream=True, timeout=(5, 10), allow_redirects=True, verify=False)
+    response.close()
+    
+    if response.status_code >= 400:
+        raise Exception(f"Probe returned HTTP {response.status_code}")
+    
+    if response.status_code == 206:
+        return _content_range_total(response.headers.get('content-range'))
+    
+    content_length = response.headers.get('content-length')
+    return int(content_length) if content_length else None
+
+def open_range(video_info, start, end):
+    """Start a Range request for bytes start..end (inclusive) of a direct URL"""
+    headers = build_stream_headers(video_info)
+    headers['Range'] = f'bytes={start}-{end}'
+    response = cdn_session.get(video_info['direct_url'], headers=headers, stream=True,
+                               timeout=(5, 10), allow_redirects=True, verify=False)
+    if response.status_code != 206:
+        response.close()
+        raise MP4Error(f"Range request returned HTTP {response.status_code}")
+    return response
+
+def fetch_range(video_info, start, end):
+    """Read bytes start..end (inclusive) of a direct URL with a Range request"""
+    response = open_range(video_info, start, end)
+    try:
+        # Never read more than asked for, even from a server that ignores the range
+        return response.raw.read(end - start + 1, decode_content=True)
+    finally:
+        response.close()
+
+def probe_media_info(video_info):
+    """Fill duration, width, height and bitrate on MP4 video info from its header bytes
+    
+    Costs one Range request for faststart files and a few small ones when
+    moov is at the end, instead of a full extraction. Each video info is
+    probed at most once, whether or not it works. Returns the file size
+    from Content-Range, or None when the URL did not answer the range.
+    """
+    if not MP4_PROBE or video_info.get('media_probed') or video_info.get('mimetype', 'video/mp4') != 'video/mp4':
+        return None
+    if all(video_info.get(field) for field in ('duration', 'width', 'height', 'bitrate')):
+        return None
+    video_info['media_probed'] = True
+    
+    file_size = None
+    try:
+        response = open_range(video_info, 0, MP4_PROBE_BYTES - 1)
+        try:
+            file_size = _content_range_total(response.headers.get('content-range'))
+            head = response.raw.read(MP4_PROBE_BYTES, decode_content=True)
+        finally:
+            response.close()
+        if not file_size:
+            raise MP4Error("No file size in Content-Range")
+        if not video_info.get('filesize'):
+            video_info['filesize'] = file_size
+        fetch = lambda start, end: fetch_range(video_info, start, end)
+        metadata = probe_metadata(fetch, file_size, head, MP4_MAX_MOOV_MB * 1024 * 1024)
+    except (MP4Error, requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+        logger.info(f"Media probe failed: {str(e)}")
+        MEDIA_PROBES.labels('failed').inc()
+        return file_size
+    
+    # Provider values win; the probe only fills gaps
+    for field, value in metadata.items():
+        if value and not video_info.get(field):
+            video_info[field] = value
+    MEDIA_PROBES.labels('ok').inc()
+    return file_size
+
+def wait_for_media_probe(video_info):
+    """Probe media metadata, giving up after PROBE_TIMEOUT
+    
+    Returns the file size the probe saw, or None. A probe that runs late
+    still fills the cached video info for next time.
+    """
+    probe = eventlet.spawn(probe_media_info, video_info)
+    with eventlet.Timeout(PROBE_TIMEOUT, False):
+        return probe.wait()
+    return None
+
+def plan_stream_faststart(video_info, filesize, trace):
+    """Faststart plan for a proxied MP4 whose moov sits after the media data, or None"""
+    if not MP4_FASTSTART or not filesize or video_info.get('mimetype', 'video/mp4') != 'video/mp4':
+        return None
+    
+    with trace.span('faststart_check') as span:
+        try:
+            fetch = lambda start, end: fetch_range(video_info, start, end)
+            head = fetch(0, min(filesize, MP4_HEAD_BYTES) - 1)
+            plan = plan_faststart(fetch, filesize, head, MP4_MAX_MOOV_MB * 1024 * 1024)
+        except (MP4Error, requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+            logger.info(f"Not rewriting for faststart: {str(e)}")
+            span['outcome'] = 'unsupported'
+            FASTSTART_CHECKS.labels('unsupported').inc()
+            return None
+        
+        result = 'already_faststart' if plan is None else 'rewritten'
+        span['outcome'] = result
+        FASTSTART_CHECKS.labels(result).inc()
+        return plan
+
+def fill_filesize(video_info):
+    """Fill a missing filesize on video info from a size probe"""
+    if not video_info.get('filesize'):
+        try:
+            video_info['filesize'] = probe_filesize(video_info)
+        except Exception as e:
+            logger.warning(f"Size probe failed: {str(e)}")
+    return video_info.get('filesize')
+
+def start_size_probe(video_info):
+    """Start a background size probe when the provider did not report a filesize"""
+    if video_info.get('filesize'):
+        return None
+    return eventlet.spawn(fill_filesize, video_info)
+
+def wait_for_size_probe(probe, video_info):
+    """Wait briefly for a size probe and return whatever filesize is known"""
+    if probe is not None:
+        with eventlet.Timeout(PROBE_TIMEOUT, False):
+            probe.wait()
+    return video_info.get('filesize')
+
+def probe_headerless(video_info, origin):
+    """Check whether a browser could fetch a direct URL by itself
+    
+    Requests one byte with only a browser User-Agent and an Origin, the way
+    fetch() from the frontend would, and requires a video response that
+    allows that origin via CORS.
+    """
+    headers = {
+        'User-Agent': random.choice(extractor.tiktok_extractor.user_agents),
+        'Origin': origin,
+        'Range': 'bytes=0-0',
+    }
+    try:
+        response = requests.get(video_info['direct_url'], headers=headers, stream=True,
+                                timeout=(5, 10), allow_redirects=True)
+        response.close()
+    except requests.exceptions.RequestException:
+        return False
+    
+    allowed_origin = response.headers.get('access-control-allow-origin')
+    content_type = response.headers.get('content-type', '')
+    return (response.status_code in (200, 206)
+            and allowed_origin in ('*', origin)
+            and not content_type.startswith(('text/', 'application/json')))
+
+def record_redirect_result(service, ok):
+    """Count a header-less success or failure for a provider"""
+    stats = redirect_stats.setdefault(service, {'ok': 0, 'failed': 0})
+    stats['ok' if ok else 'failed'] += 1
+    # Halve old samples so a provider that changes behaviour is relearned
+    if stats['ok'] + stats['failed'] > 100:
+        stats['ok'] //= 2
+        stats['failed'] //= 2
+    REDIRECT_PROBES.labels(service, 'ok' if ok else 'failed').inc()
+
+def _run_redirect_probe(video_info, origin):
+    record_redirect_result(video_info['service'], probe_headerless(video_info, origin))
+
+def start_redirect_probe(video_info, origin):
+    """Probe a provider in the background until it is learned, then occasionally"""
+    service = video_info.get('service')
+    if REDIRECT_MODE == 'off' or not service:
+        return
+    stats = redirect_stats.get(service, {'ok': 0, 'failed': 0})
+    if stats['ok'] + stats['failed'] < REDIRECT_MIN_SAMPLES or random.random() < REDIRECT_REPROBE_RATE:
+        eventlet.spawn(_run_redirect_probe, video_info, origin)
+
+def redirect_safe(video_info):
+    """True when the provider's direct URLs have been working without our headers"""
+    if REDIRECT_MODE == 'off' or not video_info.get('direct_url', '').startswith('https://'):
+        return False
+    stats = redirect_stats.get(video_info.get('service'))
+    if not stats or stats['ok'] < REDIRECT_MIN_SAMPLES:
+        return False
+    return stats['failed'] / (stats['ok'] + stats['failed']) <= REDIRECT_MAX_FAILURE_RATIO
+
+def _run_prefetch(key, url, video_info, hits=0, mode='video', quality=None, filesize=None):
+    """Background job: resolve and probe a video, then keep it warm
+    
+    A filesize the caller already read from the direct URL skips the probe.
+    """
+    try:
+        if video_info is None:
+            video_info = extractor.extract_direct_url(url, mode, quality)
+        if not filesize:
+            filesize = probe_filesize(video_info)
+        if not video_info.get('filesize'):
+            video_info['filesize'] = filesize
+        cache_video_info(url, video_info, hits)
+        logger.info(f"Prefetched: {video_info['title']}")
+        return video_info
+    except Exception as e:
+        logger.warning(f"Prefetch failed for {url}: {str(e)}")
+        # Keep a refreshed entry's old URL until it expires on its own
+        if not hits:
+            prefetched_videos.pop(key, None)
+        return None
+    finally:
+        prefetch_jobs.pop(key, None)
+
+def start_prefetch(url, video_info=None, hits=0, mode='video', quality=None, filesize=None):
+    """Start a background prefetch for a URL unless one is already running"""
+    if video_info is not None:
+        mode = video_info.get('mode', 'video')
+        quality = video_info.get('quality')
+    key = _prefetch_key(url, mode, quality)
+    if key not in prefetch_jobs:
+        prefetch_jobs[key] = eventlet.spawn(_run_prefetch, key, url, video_info, hits, mode, quality, filesize)
+    return prefetch_jobs[key]
+
+def resolve_video_info(url, mode='video', quality=None):
+    """Return warm video info for a URL, mode and quality, falling back to a fresh extraction"""
+    key = _prefetch_key(url, mode, quality)
+    
+    entry = prefetched_videos.get(key)
+    now = time.time()
+    if entry and entry['expires_at'] > now:
+        logger.info(f"Using prefetched video info for: {url}")
+        URL_CACHE_LOOKUPS.labels('hit').inc()
+        prefetched_videos.move_to_end(key)
+        entry['hits'] += 1
+        if _refresh_due(entry, now):
+            refresh_video_info(entry)
+        trace = current_trace()
+        if trace is not None:
+            trace.mark('prefetch_hit')
+        return entry['video_info']
+    URL_CACHE_LOOKUPS.labels('expired' if entry else 'miss').inc()
+    prefetched_videos.pop(key, None)
+    
+    # Wait for a prefetch that is already resolving this URL
+    job = prefetch_jobs.get(key)
+    if job is not None:
+        with trace_span('prefetch_wait'):
+            video_info = job.wait()
+        if video_info:
+            return video_info
+    
+    with trace_span('extract'):
+        video_info = extractor.extract_direct_url(url, mode, quality)
+    cache_video_info(url, video_info)
+    return video_info
+
+def cleanup_prefetched():
+    """Drop expired entries from the prefetch cache and refresh hot ones about to expire"""
+    now = time.time()
+    for key, entry in list(prefetched_videos.items()):
+        if entry['expires_at'] <= now:
+            del prefetched_videos[key]
+        elif _refresh_due(entry, now):
+            refresh_video_info(entry)
+
+rate_limiter = RateLimiter(
+    RedisBucketStore(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else MemoryBucketStore(),
+    {
+        'extraction': parse_budget(RATE_LIMIT_EXTRACTION, '20/60'),
+        'streaming': parse_budget(RATE_LIMIT_STREAMING, '30/60'),
+    },
+    enabled=RATE_LIMIT_ENABLED
+)
+
+def client_key():
+    """Identify the client for rate limiting: a known API key, else its IP"""
+    api_key = request.headers.get('X-API-Key')
+    if api_key and api_key in RATE_LIMIT_API_KEYS:
+        return f"key:{api_key}"
+    
+    # Clients can put anything in X-Forwarded-For, so only the hops our own
+    # proxies appended (counted from the right) identify them
+    hops = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+    if TRUSTED_PROXIES and len(hops) >= TRUSTED_PROXIES:
+        return f"ip:{hops[-TRUSTED_PROXIES]}"
+    return f"ip:{request.remote_addr}"
+
+def rate_limited(budget):
+    """Reject requests over the client's budget before any upstream work"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            allowed, retry_after = rate_limiter.check(budget, client_key())
+            if not allowed:
+                RATE_LIMITED.labels(budget).inc()
+                response = jsonify({
+                    'error': 'Too many requests. Please slow down and try again shortly.',
+                    'retry_after': retry_after
+                })
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class StreamQueueFull(Exception):
+    """Raised when a stream cannot be admitted or queued"""
+    
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class StreamAdmission:
+    """Limit concurrent streams, queueing the rest in FIFO order"""
+    
+    def __init__(self, limit, max_queue, queue_timeout):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = deque()
+        self.recent_durations = deque(maxlen=50)
+    
+    def average_duration(self):
+        """Average length of recent streams, used for wait estimates"""
+        if not self.recent_durations:
+            return 30.0
+        return sum(self.recent_durations) / len(self.recent_durations)
+    
+    def estimated_wait(self, position):
+        """Seconds until the stream at a 1-based queue position gets a slot"""
+        return round(position * self.average_duration() / max(self.limit, 1), 1)
+    
+    def acquire(self, download_id):
+        """Take a stream slot, waiting in the queue if all slots are busy"""
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            return time.time()
+        
+        if len(self.waiting) >= self.max_queue:
+            STREAM_REJECTIONS.labels('queue_full').inc()
+            raise StreamQueueFull("Server is busy, please retry shortly",
+                                  max(1, int(self.estimated_wait(len(self.waiting) + 1))))
+        
+        entry = {'id': download_id, 'event': eventlet.event.Event(), 'position': None}
+        self.waiting.append(entry)
+        QUEUED_STREAMS.set(len(self.waiting))
+        self._notify_positions()
+        
+        granted = False
+        with eventlet.Timeout(self.queue_timeout, False):
+            entry['event'].wait()
+            granted = True
+        
+        if not granted:
+            # A slot may have been handed over just as the timeout fired
+            if entry['event'].ready():
+                return time.time()
+            self.waiting.remove(entry)
+            QUEUED_STREAMS.set(len(self.waiting))
+            self._notify_positions()
+            STREAM_REJECTIONS.labels('queue_timeout').inc()
+            raise StreamQueueFull("Timed out waiting for a free stream slot",
+                                  max(1, int(self.estimated_wait(len(self.waiting) + 1))))
+        
+        return time.time()
+    
+    def release(self, admitted_at=None):
+        """Free a slot, handing it straight to the next queued stream"""
+        if admitted_at is not None:
+            self.recent_durations.append(time.time() - admitted_at)
+        
+        if self.waiting:
+            entry = self.waiting.popleft()
+            QUEUED_STREAMS.set(len(self.waiting))
+            entry['event'].send(True)
+            self._notify_positions()
+        else:
+            self.active -= 1
+    
+    def _notify_positions(self):
+        """Send the queued streams whose position changed in one batched message"""
+        frames = []
+        for position, entry in enumerate(self.waiting, 1):
+            if entry['position'] == position:
+                continue
+            entry['position'] = position
+            queue_data = {
+                'id': entry['id'],
+                'status': 'queued',
+                'queue_position': position,
+                'estimated_wait': self.estimated_wait(position)
+            }
+            download = active_downloads.get(entry['id'])
+            if download is not None:
+                download.update(queue_data)
+            frames.append(queue_data)
+        if frames:
+            socket_emit('download_queued_batch', {'frames': frames})
+
+stream_admission = StreamAdmission(MAX_CONCURRENT_STREAMS, MAX_QUEUED_STREAMS, STREAM_QUEUE_TIMEOUT)
+
+class TransferCounter:
+    """Byte count of one transfer, written by its loop and read by the progress ticker"""
+    
+    __slots__ = ('download_id', 'status', 'total', 'bytes', 'started', 'reported')
+    
+    def __init__(self, download_id, status, total):
+        self.download_id = download_id
+        self.status = status
+        self.total = total
+        self.bytes = 0
+        self.started = time.time()
+        self.reported = -1
+
+class ProgressTicker:
+    """Snapshot every active transfer at a fixed interval and send one batched frame
+    
+    Transfer loops only bump counter.bytes; records, speeds and Socket.IO
+    traffic are all handled here, so the cost no longer grows with chunks.
+    """
+    
+    def __init__(self, interval):
+        self.interval = interval
+        self.counters = {}
+        self.thread = None
+    
+    def register(self, download_id, status, total):
+        counter = self.counters[download_id] = TransferCounter(download_id, status, total)
+        if self.thread is None:
+            self.thread = eventlet.spawn(self._run)
+        return counter
+    
+    def unregister(self, counter):
+        """Stop tracking a transfer and write its final progress into the record
+        
+        Returns the final progress fields, or None if it was already unregistered.
+        """
+        if self.counters.get(counter.download_id) is not counter:
+            return None
+        del self.counters[counter.download_id]
+        progress = self.progress(counter, time.time())
+        download = active_downloads.get(counter.download_id)
+        if download is not None:
+            download.set_progress(progress)
+        return progress
+    
+    def _run(self):
+        while self.counters:
+            eventlet.sleep(self.interval)
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Progress tick failed: {str(e)}")
+        self.thread = None
+    
+    @staticmethod
+    def progress(counter, now):
+        """Progress fields for a counter's current byte count"""
+        downloaded = counter.bytes
+        total = counter.total
+        elapsed = now - counter.started
+        speed = downloaded / elapsed if elapsed > 0 else 0
+        return {
+            'downloaded_bytes': downloaded,
+            'speed': speed,
+            'percentage': round(downloaded / total * 100, 1) if total else 0,
+            'eta': (total - downloaded) / speed if speed > 0 and downloaded < total else 0
+        }
+    
+    def tick(self):
+        """Update records and emit one download_progress_batch for transfers that moved"""
+        now = time.time()
+        frames = []
+        for counter in list(self.counters.values()):
+            if counter.bytes == counter.reported:
+                continue
+            counter.reported = counter.bytes
+            progress = self.progress(counter, now)
+            # Progress is not versioned, so delta sync does not repeat this batch
+            download = active_downloads.get(counter.download_id)
+            if download is not None:
+                download.set_progress(progress)
+            frames.append({
+                'id': counter.download_id,
+                'status': counter.status,
+                'total_bytes': counter.total,
+                **progress
+            })
+        
+        if frames:
+            PROGRESS_BATCH_SIZE.observe(len(frames))
+            socket_emit('download_progress_batch', {'frames': frames})
+
+progress_ticker = ProgressTicker(PROGRESS_INTERVAL)
+
+class StreamStalled(Exception):
+    """Raised when the upstream CDN stops delivering data"""
+    
+    def __init__(self, message, status='stalled'):
+        super().__init__(message)
+        self.status = status
+
+def reconnect_upstream(url, video_info, offset, end, full_size, trace, max_attempts=None):
+    """Reopen a broken stream at a byte offset on the same URL or another service's
+    
+    The same URL is retried first, then further services from the extraction
+    chain are extracted one at a time. A candidate is only accepted if it
+    answers with a partial response starting at the offset for a file of the
+    same total size, so the bytes continue the ones already sent.
+    Returns (response, video_info), or (None, None) when nothing fits.
+    """
+    def candidates():
+        yield video_info
+        if url:
+            yield from extractor.iter_alternatives(url, skip={video_info.get('service')},
+                                                   mode=video_info.get('mode', 'video'),
+                                                   quality=video_info.get('quality'))
+    
+    max_attempts = STREAM_MAX_FAILOVERS if max_attempts is None else max_attempts
+    range_value = f"bytes={offset}-{end if end is not None else ''}"
+    with tracing(trace):
+        return _try_candidates(candidates(), range_value, offset, full_size, trace, max_attempts)
+
+def _try_candidates(candidates, range_value, offset, full_size, trace, max_attempts):
+    """Return the first candidate whose response continues the stream at offset"""
+    for attempt, candidate in enumerate(candidates, 1):
+        service = candidate.get('service', 'unknown')
+        headers = build_stream_headers(candidate)
+        headers['Range'] = range_value
+        outcome = 'mismatch'
+        with trace.span('failover', attempt=attempt, service=service, offset=offset) as span:
+            try:
+                response = cdn_session.get(
+                    candidate['direct_url'],
+                    headers=headers,
+                    stream=True,
+                    timeout=(10, STREAM_IDLE_TIMEOUT),
+                    allow_redirects=True,
+                    verify=False
+                )
+            except requests.exceptions.RequestException as e:
+                outcome = span['outcome'] = 'error'
+                span['error'] = str(e)[:200]
+            else:
+                content_range = response.headers.get('content-range')
+                span['status_code'] = response.status_code
+                if (response.status_code == 206
+                        and _content_range_start(content_range) == offset
+                        and _content_range_total(content_range) == full_size):
+                    STREAM_FAILOVERS.labels(service, 'resumed').inc()
+                    logger.info(f"🔁 Resumed stream at byte {offset} via {service}")
+                    return response, candidate
+                span['outcome'] = outcome
+                response.close()
+        STREAM_FAILOVERS.labels(service, outcome).inc()
+        if attempt >= max_attempts:
+            break
+    return None, None
+
+def perform_streaming(direct_url, video_info, download_id, filename, faststart=None):
+    """Core streaming logic with improved error handling
+    
+    With a faststart plan the header boxes and moved moov are sent first,
+    then only the media data is requested from the CDN.
+    """
+    logger.info(f"Streaming from: {direct_url[:100]}...")
+    
+    headers = build_stream_headers(video_info)
+    
+    # Handle range requests
+    range_header = request.headers.get('Range')
+    if faststart is not None:
+        range_header = f'bytes={faststart.body_start}-{faststart.body_end}'
+    if range_header:
+        headers['Range'] = range_header
+    
+    session = cdn_session
+    response = None
+    stream_started = time.time()
+    stream_status = 'error'
+    first_byte_sent = False
+    trace = active_downloads[download_id].get('trace') or DownloadTrace(download_id)
+    counter = None
+    ACTIVE_STREAMS.inc()
+    
+    try:
+        # Add retry logic for CDN issues
+        max_retries = 2
+        for attempt in range(max_retries + 1):
+            try:
+                with trace.span('upstream_connect', attempt=attempt + 1) as span:
+                    response = session.get(
+                        direct_url,
+                        headers=headers,
+                        stream=True,
+                        timeout=(10, STREAM_IDLE_TIMEOUT),
+                        allow_redirects=True,
+                        verify=False
+                    )
+                    span['status_code'] = response.status_code
+                
+                if response.status_code == 403:
+                    if attempt < max_retries:
+                        logger.warning(f"403 Forbidden, retrying... (attempt {attempt + 1})")
+                        response.close()
+                        time.sleep(1)
+                        continue
+                    else:
+                        # The signed URL may have expired, so do not hand it out again
+                        invalidate_video_info(active_downloads[download_id].get('url'),
+                                              video_info.get('mode', 'video'), video_info.get('quality'))
+                        raise Exception("Access forbidden after multiple attempts. The video may be protected or temporarily unavailable.")
+                
+                elif response.status_code == 404:
+                    raise Exception("Video not found. It may have been deleted.")
+                
+                elif response.status_code >= 400:
+                    raise Exception(f"HTTP {response.status_code}: {response.reason}")
+                
+                # If we get here, the request was successful
+                break
+                
+            except requests.exceptions.Timeout:
+                if attempt < max_retries:
+                    logger.warning(f"Timeout, retrying... (attempt {attempt + 1})")
+                    continue
+                else:
+                    raise Exception("Connection timeout after multiple attempts")
+        
+        if faststart is not None and response.status_code != 206:
+            # The moved moov only fits in front of exactly the planned body range
+            response.close()
+            raise Exception(f"Upstream ignored the media range (HTTP {response.status_code})")
+        
+        total_size = int(response.headers.get('content-length', 0))
+        if not total_size and not range_header:
+            total_size = video_info.get('filesize') or 0
+        expected_size = total_size
+        # Where the body sits in the file, so a broken upstream can be resumed elsewhere
+        if response.status_code == 206:
+            full_size = _content_range_total(response.headers.get('content-range'))
+            resume_from = _parse_range(range_header)
+        else:
+            full_size = total_size
+            resume_from = (0, None)
+        if not full_size:
+            # Without a known file size a different file could not be told apart
+            resume_from = None
+        source_url = active_downloads[download_id].get('url')
+        failovers = 0
+        prefix_size = len(faststart.prefix) if faststart is not None else 0
+        active_downloads[download_id].update({
+            'total_bytes': total_size + prefix_size,
+            'status': 'streaming'
         })
         
         downloaded = 0
-        chunk_size = 32768
+        counter = progress_ticker.register(download_id, 'streaming', total_size + prefix_size)
+        chunk_size = STREAM_CHUNK_MIN
         start_time = time.time()
-        last_progress_time = start_time
+        last_resize_time = start_time
+        last_resize_bytes = 0
+        # Split transfer time between waiting on the CDN and on the client
+        upstream_wait = 0.0
+        client_wait = 0.0
+        read_started = start_time
+        read = response.raw.read
+        count_bytes = STREAM_BYTES.inc
+        # Throughput watchdog window, measured against time spent waiting on the CDN
+        window_started = start_time
+        window_bytes = 0
+        window_wait = 0.0
         
-        for chunk in response.iter_content(chunk_size=chunk_size):
-            if chunk:
-                downloaded += len(chunk)
-                current_time = time.time()
-                
-                if current_time - last_progress_time >= 1.0 or downloaded >= total_size:
-                    elapsed_time = current_time - start_time
-                    speed = downloaded / elapsed_time if elapsed_time > 0 else 0
-                    percentage = (downloaded / total_size * 100) if total_size > 0 else 0
-                    eta = (total_size - downloaded) / speed if speed > 0 and downloaded < total_size else 0
-                    
-                    progress_data = {
-                        'id': download_id,
-                        'status': 'streaming',
-                        'downloaded_bytes': downloaded,
-                        'total_bytes': total_size,
-                        'speed': speed,
-                        'percentage': round(percentage, 1),
-                        'eta': eta
-                    }
-                    
-                    active_downloads[download_id].update(progress_data)
-                    socketio.emit('download_progress', progress_data)
-                    last_progress_time = current_time
-                
-                yield chunk
+        if prefix_size:
+            STREAM_TTFB.observe(time.time() - stream_started)
+            trace.mark('first_byte', faststart=True)
+            first_byte_sent = True
+            count_bytes(prefix_size)
+            counter.bytes = prefix_size
+            yield faststart.prefix
+        
+        failure = None
+        while True:
+            if failure is None:
+                try:
+                    chunk = read(chunk_size, decode_content=True)
+                except urllib3.exceptions.ReadTimeoutError:
+                    failure = StreamStalled(f"No data from the video server for {STREAM_IDLE_TIMEOUT:.0f} seconds")
+                except urllib3.exceptions.ProtocolError:
+                    failure = StreamStalled(
+                        f"Video server closed the connection after {downloaded} of {expected_size or 'unknown'} bytes",
+                        status='truncated'
+                    )
+                else:
+                    if not chunk and expected_size and downloaded < expected_size:
+                        failure = StreamStalled(
+                            f"Video server closed the connection after {downloaded} of {expected_size} bytes",
+                            status='truncated'
+                        )
             
-            if time.time() - start_time > 300:  # 5 minute timeout
-                logger.warning("Streaming timeout reached")
+            if failure is not None:
+                # Continue the same client response from another source if one lines up
+                if resume_from is None or failovers >= STREAM_MAX_FAILOVERS:
+                    raise failure
+                failovers += 1
+                logger.warning(f"Stream {download_id} {failure.status}, failing over: {str(failure)}")
+                response.close()
+                response, resumed_info = reconnect_upstream(
+                    source_url, video_info, resume_from[0] + downloaded, resume_from[1], full_size, trace
+                )
+                if response is None:
+                    raise failure
+                video_info = resumed_info
+                read = response.raw.read
+                failure = None
+                read_started = window_started = time.time()
+                window_bytes = downloaded
+                window_wait = upstream_wait
+                continue
+            if not chunk:
                 break
+            
+            chunk_length = len(chunk)
+            downloaded += chunk_length
+            current_time = time.time()
+            upstream_wait += current_time - read_started
+            
+            # Size reads to the observed throughput so fast streams take fewer iterations
+            if (current_time - last_resize_time >= STREAM_RESIZE_INTERVAL
+                    or downloaded - last_resize_bytes >= chunk_size * 16):
+                rate = (downloaded - last_resize_bytes) / max(current_time - last_resize_time, 1e-6)
+                chunk_size = min(STREAM_CHUNK_MAX, max(STREAM_CHUNK_MIN, int(rate * STREAM_CHUNK_INTERVAL)))
+                last_resize_time = current_time
+                last_resize_bytes = downloaded
+            
+            counter.bytes = prefix_size + downloaded
+            if not first_byte_sent:
+                STREAM_TTFB.observe(current_time - stream_started)
+                trace.mark('first_byte')
+                first_byte_sent = True
+            count_bytes(chunk_length)
+            yield chunk
+            read_started = time.time()
+            client_wait += read_started - current_time
+            
+            # A slow client only adds client wait, so only a slow CDN trips this
+            if read_started - window_started >= STREAM_STALL_WINDOW:
+                cdn_wait = upstream_wait - window_wait
+                cdn_bytes = downloaded - window_bytes
+                if cdn_wait >= STREAM_STALL_WINDOW / 2 and cdn_bytes / cdn_wait < STREAM_MIN_BPS:
+                    failure = StreamStalled(f"Video server is too slow ({cdn_bytes / cdn_wait / 1024:.1f} KB/s)")
+                window_started = read_started
+                window_bytes = downloaded
+                window_wait = upstream_wait
         
         # Streaming completed successfully
+        stream_status = 'completed'
         total_time = time.time() - start_time
-        active_downloads[download_id].update({
-            'status': 'completed',
-            'total_time': total_time,
-            'percentage': 100
-        })
-        
-        socketio.emit('download_status', {
+        trace.mark('last_byte', bytes=downloaded)
+        trace.add('transfer', start_time, time.time(), bytes=downloaded,
+                  upstream_wait=round(upstream_wait, 4), client_wait=round(client_wait, 4))
+        status_data = {
             'id': download_id,
+            **progress_ticker.unregister(counter),
             'status': 'completed',
             'percentage': 100,
+            'eta': 0,
             'total_time': total_time
-        })
+        }
+        active_downloads[download_id].update(status_data)
+        socket_emit('download_status', status_data)
         
+    except GeneratorExit:
+        # The client went away before the stream finished
+        stream_status = 'cancelled'
+        active_downloads[download_id]['status'] = 'cancelled'
+        raise
+    except StreamStalled as e:
+        stream_status = e.status
+        logger.warning(f"Stream {download_id} {e.status}: {str(e)}")
+        trace.mark(e.status, bytes=downloaded, error=str(e))
+        raise
     except Exception as e:
         raise
     finally:
-        session.close()
+        ACTIVE_STREAMS.dec()
+        STREAM_RESULTS.labels(stream_status).inc()
+        if counter is not None:
+            progress_ticker.unregister(counter)
+        if response is not None:
+            response.close()
+        if stream_status != 'error':
+            trace.finish(stream_status)
+
+download_pool = eventlet.GreenPool(JOB_WORKERS)
+
+def job_path(download_id):
+    """Where a background job keeps its file"""
+    return os.path.join(JOB_DIR, download_id)
+
+def job_record(download_id):
+    """Record of a job, including harvest files whose record has left the history"""
+    download = active_downloads.get(download_id)
+    if download is None and download_id in harvest_files:
+        download = harvest_files[download_id]['record']
+    return download
+
+def job_dir_bytes():
+    """Bytes used by background job files, finished or in progress"""
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(JOB_DIR) if entry.is_file())
+    except OSError:
+        return 0
+
+def job_capacity_error():
+    """Why no more background jobs should start right now, or None"""
+    if download_pool.waiting() >= JOB_MAX_QUEUED:
+        return 'Too many background downloads queued, please retry shortly'
+    if job_dir_bytes() >= JOB_MAX_DISK_MB * 1024 * 1024:
+        return 'Server storage for background downloads is full, please retry later'
+    return None
+
+def busy_response(message, retry_after):
+    """503 with Retry-After for work the server has no room for right now"""
+    response = jsonify({'error': message, 'retry_after': retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def open_job_upstream(video_info, trace):
+    """Open the direct URL for a background job"""
+    with trace.span('upstream_connect') as span:
+        response = cdn_session.get(
+            video_info['direct_url'],
+            headers=build_stream_headers(video_info),
+            stream=True,
+            timeout=(10, STREAM_IDLE_TIMEOUT),
+            verify=False
+        )
+        span['status_code'] = response.status_code
+    if response.status_code >= 400:
+        response.close()
+        raise Exception(f"HTTP {response.status_code}: {response.reason}")
+    return response
+
+def new_download_record(download_id, url, video_info, mode, quality, delivery, trace, **fields):
+    """Record for a download that is about to be streamed, redirected or run as a job"""
+    return DownloadRecord(
+        id=download_id,
+        url=url,
+        status='queued' if delivery == 'job' else 'ready',
+        platform='tiktok',
+        title=video_info['title'],
+        filename=video_info['filename'],
+        filesize=video_info['filesize'],
+        mimetype=video_info.get('mimetype', 'video/mp4'),
+        created_at=datetime.now().isoformat(),
+        type='job' if delivery == 'job' else 'streaming',
+        mode=mode,
+        quality=quality,
+        service=video_info.get('service'),
+        delivery=delivery,
+        thumbnail_url=register_thumbnail(url, video_info),
+        trace=trace,
+        **fields
+    )
+
+def start_download_job(download_id, video_info):
+    """Queue a background job; the pool bounds how many transfer at once"""
+    active_downloads[download_id]['queued_at'] = time.time()
+    eventlet.spawn(download_pool.spawn_n, run_download_job, download_id, video_info)
+
+def run_download_job(download_id, video_info):
+    """Background job: download a video to disk, then let the client collect it
+    
+    The upstream connection is read as fast as the CDN delivers and closed
+    before the client fetches anything, so a slow client never holds it open.
+    """
+    download = active_downloads.get(download_id)
+    if download is None:
+        # Cleared while it was queued
+        return
+    trace = download['trace']
+    trace.add('job_queue', download['queued_at'], time.time())
+    path = job_path(download_id)
+    part_path = path + '.part'
+    max_bytes = JOB_MAX_FILE_MB * 1024 * 1024
+    status = 'error'
+    response = None
+    downloaded = 0
+    counter = None
+    ACTIVE_JOBS.inc()
+    
+    try:
+        download['status'] = 'downloading'
+        socket_emit('download_status', {'id': download_id, 'status': 'downloading'})
+        
+        response = open_job_upstream(video_info, trace)
+        total_size = int(response.headers.get('content-length', 0)) or video_info.get('filesize') or 0
+        if total_size > max_bytes:
+            raise Exception(f"Video is larger than the {JOB_MAX_FILE_MB} MB background download limit")
+        download['total_bytes'] = total_size
+        counter = progress_ticker.register(download_id, 'downloading', total_size)
+        
+        os.makedirs(JOB_DIR, exist_ok=True)
+        failovers = 0
+        start_time = time.time()
+        with open(part_path, 'wb') as f:
+            while True:
+                failure = None
+                try:
+                    chunk = response.raw.read(JOB_CHUNK_SIZE, decode_content=True)
+                except (urllib3.exceptions.ReadTimeoutError, urllib3.exceptions.ProtocolError) as e:
+                    failure = StreamStalled(f"Video server connection failed after {downloaded} bytes: {str(e)}",
+                                            status='truncated')
+                else:
+                    if not chunk and total_size and downloaded < total_size:
+                        failure = StreamStalled(
+                            f"Video server closed the connection after {downloaded} of {total_size} bytes",
+                            status='truncated'
+                        )
+                
+                if failure is not None:
+                    # Resume at the current offset, as perform_streaming does
+                    if not total_size or failovers >= STREAM_MAX_FAILOVERS:
+                        raise failure
+                    failovers += 1
+                    logger.warning(f"Job {download_id} {failure.status}, failing over: {str(failure)}")
+                    response.close()
+                    response, resumed_info = reconnect_upstream(
+                        download['url'], video_info, downloaded, None, total_size, trace
+                    )
+                    if response is None:
+                        raise failure
+                    video_info = resumed_info
+                    continue
+                if not chunk:
+                    break
+                
+                f.write(chunk)
+                downloaded += len(chunk)
+                if downloaded > max_bytes:
+                    raise Exception(f"Video is larger than the {JOB_MAX_FILE_MB} MB background download limit")
+                counter.bytes = downloaded
+        
+        # Release the upstream connection before anyone starts reading the file
+        response.close()
+        response = None
+        os.replace(part_path, path)
+        
+        status = 'completed'
+        total_time = time.time() - start_time
+        trace.add('transfer', start_time, time.time(), bytes=downloaded)
+        status_data = {
+            'id': download_id,
+            **progress_ticker.unregister(counter),
+            'status': 'completed',
+            'percentage': 100,
+            'eta': 0,
+            'downloaded_bytes': downloaded,
+            'filesize': downloaded,
+            'total_time': total_time,
+            'file_url': f'/api/jobs/{download_id}/file',
+            'expires_at': datetime.fromtimestamp(time.time() + JOB_TTL).isoformat()
+        }
+        download.update(status_data)
+        socket_emit('download_status', status_data)
+        logger.info(f"✅ Job {download_id} finished: {downloaded} bytes in {total_time:.1f}s")
+        
+    except Exception as e:
+        if isinstance(e, StreamStalled):
+            status = e.status
+        error_msg = f"Download failed: {str(e)}"
+        logger.error(f"Job {download_id} failed: {str(e)}")
+        trace.mark('job_error', bytes=downloaded, error=str(e)[:200])
+        download.update({'status': 'error', 'error': error_msg})
+        socket_emit('download_status', {'id': download_id, 'status': 'error', 'error': error_msg})
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+    finally:
+        ACTIVE_JOBS.dec()
+        JOB_RESULTS.labels(status).inc()
+        if counter is not None:
+            progress_ticker.unregister(counter)
+        if response is not None:
+            response.close()
+        trace.finish(status)
+        active_downloads.retire(download_id)
+
+# Harvest fields kept out of API and Socket.IO payloads
+HARVEST_PRIVATE_FIELDS = frozenset({'finished', 'state', 'client'})
+
+def public_harvest(harvest):
+    return {k: v for k, v in harvest.items() if k not in HARVEST_PRIVATE_FIELDS}
+
+def public_harvest_file(download_id):
+    entry = harvest_files[download_id]
+    record = entry['record']
+    return {
+        'harvest_id': entry['harvest']['id'],
+        'download_id': download_id,
+        'video_id': entry['video_id'],
+        'title': record.get('title'),
+        'filename': record.get('filename'),
+        'filesize': record.get('filesize'),
+        'file_url': record.get('file_url'),
+        'expires_at': record.get('expires_at'),
+        'collected': entry['collected']
+    }
+
+def collect_harvest_file(download_id):
+    """Record a harvest video as done once its whole file has been sent to the client"""
+    entry = harvest_files.get(download_id)
+    if entry is None or entry['collected']:
+        return
+    entry['collected'] = True
+    harvest = entry['harvest']
+    harvest['state'].mark_done(entry['video_id'])
+    harvest['collected'] += 1
+    PROFILE_VIDEOS.labels('collected').inc()
+    socket_emit('profile_status', public_harvest(harvest))
+
+def expire_harvest_file(download_id):
+    """Forget a harvest file that was deleted; if never collected, a rerun fetches it again"""
+    entry = harvest_files.pop(download_id, None)
+    if entry is not None and not entry['collected']:
+        entry['harvest']['expired'] += 1
+        PROFILE_VIDEOS.labels('expired').inc()
+
+def send_then_collect(response, download_id):
+    """Wrap a job file response so its harvest video is marked done after the last byte
+    
+    A client that disconnects midway never reaches the end, so the video
+    stays pending; a range that runs to the end of the file counts. With
+    USE_X_SENDFILE the proxy sends the body, so handing it over has to do.
+    """
+    if response.status_code == 206:
+        content_range = response.content_range
+        if content_range is None or content_range.stop != content_range.length:
+            return response
+    elif response.status_code != 200:
+        return response
+    
+    body = response.response
+    def send():
+        try:
+            for chunk in body:
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        collect_harvest_file(download_id)
+    
+    response.response = send()
+    return response
+
+def wait_for_harvest_capacity(harvest):
+    """Hold a harvest until the job queue and disk have room and its client has budget
+    
+    Each video costs one token from the extraction budget of the client that
+    started the harvest, the same as a quick download would.
+    """
+    while True:
+        if job_capacity_error() is None:
+            allowed, retry_after = rate_limiter.check('extraction', harvest['client'])
+            if allowed:
+                return
+        else:
+            # Expired files are the only way disk space comes back
+            cleanup_job_files()
+            retry_after = PROFILE_CAPACITY_WAIT
+        eventlet.sleep(retry_after)
+
+def harvest_video(harvest, slots, video_id, url, mode, quality):
+    """Extract one profile video and download it as a background job"""
+    try:
+        download_id = str(uuid.uuid4())
+        trace = DownloadTrace(download_id)
+        try:
+            with tracing(trace):
+                video_info = resolve_video_info(url, mode, quality)
+        except Exception as e:
+            trace.finish('extraction_failed')
+            raise Exception(f"Extraction failed: {str(e)}")
+        
+        record = active_downloads[download_id] = new_download_record(download_id, url, video_info, mode, quality,
+                                                                     'job', trace, harvest_id=harvest['id'])
+        record['queued_at'] = time.time()
+        # The shared pool still bounds transfers across every harvest and API job
+        download_pool.spawn(run_download_job, download_id, video_info).wait()
+        
+        if record['status'] != 'completed':
+            raise Exception(record.get('error') or f"Download ended as {record['status']}")
+        # Only collecting the file marks the video done, so it is indexed outside the history
+        harvest_files[download_id] = {'harvest': harvest, 'video_id': video_id, 'record': record, 'collected': False}
+        harvest['completed'] += 1
+        PROFILE_VIDEOS.labels('completed').inc()
+        socket_emit('profile_file', public_harvest_file(download_id))
+    except Exception as e:
+        logger.warning(f"Profile @{harvest['username']} video {video_id} failed: {str(e)}")
+        harvest['failed'] += 1
+        PROFILE_VIDEOS.labels('failed').inc()
+    finally:
+        slots.release()
+        socket_emit('profile_status', public_harvest(harvest))
+
+def run_profile_harvest(harvest, mode, quality, limit):
+    """Background job: walk a profile lazily and download each video not done before
+    
+    At most PROFILE_CONCURRENCY videos are in flight, and the next page of the
+    profile is only requested when a slot frees up, so memory stays flat
+    however many videos the profile has. A video counts as done once its
+    file has been collected.
+    """
+    username = harvest['username']
+    state = harvest['state'] = HarvestState(os.path.join(PROFILE_STATE_DIR, f"{username.lower()}.done"))
+    harvest['resumed_from'] = len(state)
+    slots = eventlet.semaphore.Semaphore(PROFILE_CONCURRENCY)
+    try:
+        for video_id, url in iter_profile_videos(username, load_yt_dlp()):
+            harvest['found'] += 1
+            if video_id in state:
+                harvest['skipped'] += 1
+                PROFILE_VIDEOS.labels('skipped').inc()
+                continue
+            if limit and harvest['queued'] >= limit:
+                break
+            slots.acquire()
+            wait_for_harvest_capacity(harvest)
+            harvest['queued'] += 1
+            eventlet.spawn_n(harvest_video, harvest, slots, video_id, url, mode, quality)
+    except Exception as e:
+        logger.error(f"Profile @{username} harvest failed: {str(e)}")
+        harvest.update({'status': 'error', 'error': str(e)})
+    finally:
+        # Wait for the videos still in flight
+        for _ in range(PROFILE_CONCURRENCY):
+            slots.acquire()
+        if harvest['status'] == 'running':
+            harvest['status'] = 'completed'
+        logger.info(f"Profile @{username} {harvest['status']}: {harvest['completed']} ready to collect, "
+                    f"{harvest['skipped']} already done, {harvest['failed']} failed")
+        harvest['finished'] = time.time()
+        socket_emit('profile_status', public_harvest(harvest))
+
+@app.before_request
+def schedule_prewarm():
+    """The first request means the server is listening, so heavy imports can follow"""
+    start_prewarm()
 
 @app.route('/api/download/quick', methods=['POST'])
+@rate_limited('extraction')
 def quick_download():
     """Quick download endpoint for TikTok videos"""
     try:
         data = request.json
         url = data.get('url', '').strip()
+        mode = data.get('mode', 'video')
         
         if not url:
             return jsonify({'error': 'URL is required'}), 400
         
-        logger.info(f"Processing quick download for: {url}")
+        if mode not in DOWNLOAD_MODES:
+            return jsonify({'error': f"mode must be one of: {', '.join(DOWNLOAD_MODES)}"}), 400
+        
+        try:
+            quality = parse_quality(data.get('quality')) if mode == 'video' else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # delivery=job downloads on the server first, for clients too slow to hold a stream
+        as_job = data.get('delivery') == 'job'
+        capacity_error = job_capacity_error() if as_job else None
+        if capacity_error:
+            return busy_response(capacity_error, max(1, int(stream_admission.average_duration())))
+        
+        logger.info(f"Processing quick download for: {url} ({mode})")
         
         # Validate it's a TikTok URL
         platform = extractor.detect_platform(url)
         if platform != 'tiktok':
             return jsonify({'error': 'Only TikTok URLs are supported. Please provide a valid TikTok video URL.'}), 400
         
+        download_id = str(uuid.uuid4())
+        trace = DownloadTrace(download_id)
+        
         try:
-            video_info = extractor.extract_direct_url(url)
+            with tracing(trace):
+                video_info = resolve_video_info(url, mode, quality)
             logger.info(f"Successfully extracted: {video_info['title']}")
         except Exception as e:
             error_msg = str(e)
@@ -746,36 +2503,55 @@ def quick_download():
             else:
                 error_msg = f"Failed to download TikTok video. Please try again later. Error: {error_msg}"
             
+            trace.finish('extraction_failed')
             return jsonify({'error': error_msg}), 400
         
-        download_id = str(uuid.uuid4())
+        # Fill in the size concurrently with setting up the download record
+        size_probe = start_size_probe(video_info)
+        if as_job:
+            delivery = 'job'
+        else:
+            # The page that will fetch the URL may be served from another origin than the API
+            start_redirect_probe(video_info, request.headers.get('Origin') or request.host_url.rstrip('/'))
+            delivery = 'redirect' if redirect_safe(video_info) else 'proxy'
         
-        active_downloads[download_id] = {
-            'id': download_id,
-            'url': url,
-            'status': 'ready',
-            'platform': 'tiktok',
-            'title': video_info['title'],
-            'filename': video_info['filename'],
-            'filesize': video_info['filesize'],
-            'created_at': datetime.now().isoformat(),
-            'type': 'streaming'
-        }
+        active_downloads[download_id] = new_download_record(download_id, url, video_info, mode, quality,
+                                                            delivery, trace)
         
         # Clean up old downloads
         cleanup_old_downloads()
         
+        with trace.span('size_probe'):
+            filesize = wait_for_size_probe(size_probe, video_info)
+        active_downloads[download_id]['filesize'] = filesize
+        
+        if as_job:
+            start_download_job(download_id, video_info)
+        elif delivery == 'redirect':
+            # The browser fetches redirect_url itself, so the server's part ends here
+            STREAM_REDIRECTS.labels(video_info['service']).inc()
+            active_downloads[download_id]['status'] = 'redirected'
+            socket_emit('download_status', {'id': download_id, 'status': 'redirected'})
+            trace.finish('redirected')
+            active_downloads.retire(download_id)
+        
         return jsonify({
             'download_id': download_id,
             'stream_url': f'/api/stream/{download_id}',
             'filename': video_info['filename'],
-            'filesize': video_info['filesize'],
+            'filesize': filesize,
             'title': video_info['title'],
             'platform': 'tiktok',
+            'mode': mode,
+            'quality': quality,
             'duration': video_info.get('duration'),
             'thumbnail': video_info.get('thumbnail'),
+            'thumbnail_url': active_downloads[download_id]['thumbnail_url'],
             'uploader': video_info.get('uploader'),
-            'message': 'Video ready for download'
+            'delivery': delivery,
+            'redirect_url': video_info['direct_url'] if delivery == 'redirect' else None,
+            'file_url': f'/api/jobs/{download_id}/file' if as_job else None,
+            'message': 'Download queued on the server' if as_job else 'Video ready for download'
         })
         
     except Exception as e:
@@ -783,6 +2559,7 @@ def quick_download():
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 @app.route('/api/stream/<download_id>')
+@rate_limited('streaming')
 def stream_video(download_id):
     """Streaming endpoint for TikTok videos"""
     if download_id not in active_downloads:
@@ -790,28 +2567,31 @@ def stream_video(download_id):
     
     download_info = active_downloads[download_id]
     url = download_info['url']
+    trace = download_info.setdefault('trace', DownloadTrace(download_id))
     
     logger.info(f"Starting stream for TikTok: {download_id}")
     
-    def generate_stream():
+    def generate_stream(video_info, faststart=None):
+        bytes_sent = False
         try:
             active_downloads[download_id]['status'] = 'streaming'
-            socketio.emit('download_status', {
+            socket_emit('download_status', {
                 'id': download_id,
                 'status': 'streaming'
             })
             
-            # Get fresh video info for streaming
-            video_info = extractor.extract_direct_url(url)
             if not video_info or not video_info.get('direct_url'):
                 raise Exception("No video URL available for streaming")
             
-            yield from perform_streaming(
+            for chunk in perform_streaming(
                 video_info['direct_url'],
                 video_info,
                 download_id,
-                video_info['filename']
-            )
+                video_info['filename'],
+                faststart
+            ):
+                bytes_sent = True
+                yield chunk
             
         except Exception as e:
             logger.error(f"Streaming error: {str(e)}")
@@ -823,25 +2603,83 @@ def stream_video(download_id):
                     'error': error_msg
                 })
             
-            socketio.emit('download_status', {
+            socket_emit('download_status', {
                 'id': download_id,
                 'status': 'error',
                 'error': error_msg
             })
             
-            # Return error as simple text to avoid encoding issues
-            yield f"ERROR: {error_msg}".encode('utf-8')
+            trace.mark('stream_error', error=error_msg[:200])
+            trace.finish('error')
+            
+            # Once video bytes are out, error text would corrupt the file; ending
+            # short of Content-Length lets the client see the truncation instead
+            if not bytes_sent:
+                # Return error as simple text to avoid encoding issues
+                yield f"ERROR: {error_msg}".encode('utf-8')
+        finally:
+            active_downloads.retire(download_id)
+    
+    # Providers whose URLs work without our headers are served by the CDN itself;
+    # ?proxy=1 is the client falling back after the direct URL failed for it
+    if request.args.get('proxy'):
+        if download_info.get('delivery') == 'redirect':
+            record_redirect_result(download_info.get('service'), False)
+            download_info['delivery'] = 'proxy'
+        if download_id in active_downloads.finished:
+            # A redirect that failed in the browser comes back to be proxied
+            active_downloads[download_id] = download_info
+    else:
+        entry = prefetched_videos.get(_prefetch_key(url, download_info.get('mode', 'video'), download_info.get('quality')))
+        video_info = entry['video_info'] if entry and entry['expires_at'] > time.time() else None
+        if video_info and redirect_safe(video_info):
+            logger.info(f"Redirecting {download_id} to the CDN via {video_info['service']}")
+            STREAM_REDIRECTS.labels(video_info['service']).inc()
+            download_info.update({'status': 'redirected', 'delivery': 'redirect'})
+            socket_emit('download_status', {'id': download_id, 'status': 'redirected'})
+            trace.finish('redirected')
+            active_downloads.retire(download_id)
+            return redirect(video_info['direct_url'], code=302)
+    
+    # Wait for a free stream slot, or turn the client away if the queue is full
+    try:
+        with trace.span('queue_wait'):
+            admitted_at = stream_admission.acquire(download_id)
+    except StreamQueueFull as e:
+        logger.warning(f"Stream {download_id} rejected: {str(e)}")
+        trace.finish('rejected')
+        download_info.update({'status': 'error', 'error': str(e)})
+        socket_emit('download_status', {'id': download_id, 'status': 'error', 'error': str(e)})
+        active_downloads.retire(download_id)
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    
+    released = []
+    
+    def release_slot():
+        if not released:
+            released.append(True)
+            stream_admission.release(admitted_at)
     
     try:
-        # Get initial video info
-        initial_video_info = extractor.extract_direct_url(url)
-        filename = initial_video_info['filename']
-        filesize = initial_video_info.get('filesize')
+        # Reuse the prefetched video info when it is still warm
+        with tracing(trace):
+            video_info = resolve_video_info(url, download_info.get('mode', 'video'), download_info.get('quality'))
+        filename = video_info['filename']
+        size_probe = start_size_probe(video_info)
+        filesize = wait_for_size_probe(size_probe, video_info)
+        
+        # Ranged requests keep the original layout, so only full ones are rewritten
+        faststart = None
+        if not request.headers.get('Range'):
+            faststart = plan_stream_faststart(video_info, filesize, trace)
         
         # Create response with proper encoding
         response = Response(
-            stream_with_context(generate_stream()),
-            mimetype='video/mp4',
+            stream_with_context(generate_stream(video_info, faststart)),
+            mimetype=video_info.get('mimetype', 'video/mp4'),
             headers={
                 'Content-Disposition': f'attachment; filename="{filename}"',
                 'Cache-Control': 'no-cache, no-store, must-revalidate',
@@ -855,16 +2693,140 @@ def stream_video(download_id):
             }
         )
         
-        if filesize and filesize > 0:
+        # A ranged response is shorter than the file, so only advertise full sizes
+        if filesize and filesize > 0 and not request.headers.get('Range'):
             response.headers['Content-Length'] = str(filesize)
+        if faststart is not None:
+            # Byte offsets of the rewritten stream do not match the file on the CDN
+            response.headers['Accept-Ranges'] = 'none'
         
+        # The slot is held until the WSGI server closes the response
+        response.call_on_close(release_slot)
         return response
         
     except Exception as e:
         logger.error(f"Stream setup failed: {str(e)}")
+        release_slot()
+        trace.finish('setup_failed')
         return jsonify({'error': f'Stream setup failed: {str(e)}'}), 500
 
+@app.route('/api/jobs/<download_id>/file', methods=['GET'])
+@rate_limited('streaming')
+def fetch_job_file(download_id):
+    """Serve the file of a finished background download"""
+    download = job_record(download_id)
+    if download is None or download.get('type') != 'job':
+        return jsonify({'error': 'Download not found'}), 404
+    
+    if download['status'] in ('queued', 'downloading'):
+        return jsonify({
+            'error': 'Download is still in progress',
+            'status': download['status'],
+            'percentage': download.get('percentage', 0)
+        }), 409
+    
+    path = job_path(download_id)
+    if download['status'] != 'completed' or not os.path.exists(path):
+        return jsonify({'error': download.get('error') or 'Download file has expired'}), 410
+    
+    # send_file streams from disk (or hands off to the proxy with USE_X_SENDFILE)
+    # and answers Range requests, so interrupted clients can resume
+    response = send_file(
+        path,
+        mimetype=download.get('mimetype', 'video/mp4'),
+        as_attachment=True,
+        download_name=download['filename'],
+        conditional=True,
+        max_age=0
+    )
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Expose-Headers'] = 'Content-Length, Content-Range, Accept-Ranges'
+    if download_id in harvest_files:
+        response = send_then_collect(response, download_id)
+    return response
+
+@app.route('/api/profile', methods=['POST'])
+@rate_limited('extraction')
+def harvest_profile():
+    """Download every video of a TikTok profile (@username) as background jobs
+    
+    Progress arrives as profile_status Socket.IO events and at the status URL,
+    and each finished file as a profile_file event and in the files URL.
+    Posting the same profile again resumes after the videos already collected.
+    """
+    data = request.json or {}
+    username = profile_username(data.get('url'))
+    if not username:
+        return jsonify({'error': 'Provide a TikTok profile such as @username or https://www.tiktok.com/@username'}), 400
+    
+    mode = data.get('mode', 'video')
+    if mode not in DOWNLOAD_MODES:
+        return jsonify({'error': f"mode must be one of: {', '.join(DOWNLOAD_MODES)}"}), 400
+    try:
+        quality = parse_quality(data.get('quality')) if mode == 'video' else None
+        limit = int(data.get('limit') or 0)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    for harvest in profile_harvests.values():
+        if harvest['username'].lower() == username.lower() and harvest['status'] == 'running':
+            return jsonify({'error': 'This profile is already being downloaded', 'harvest_id': harvest['id']}), 409
+    
+    running = sum(1 for harvest in profile_harvests.values() if harvest['status'] == 'running')
+    if running >= MAX_PROFILE_HARVESTS:
+        return busy_response('Too many profile downloads are running, please retry later', 60)
+    capacity_error = job_capacity_error()
+    if capacity_error:
+        return busy_response(capacity_error, 60)
+    
+    harvest_id = str(uuid.uuid4())
+    harvest = profile_harvests[harvest_id] = {
+        'id': harvest_id,
+        'username': username,
+        'status': 'running',
+        'mode': mode,
+        'quality': quality,
+        'found': 0,
+        'skipped': 0,
+        'queued': 0,
+        'completed': 0,
+        'collected': 0,
+        'expired': 0,
+        'failed': 0,
+        'created_at': datetime.now().isoformat(),
+        'client': client_key()
+    }
+    eventlet.spawn_n(run_profile_harvest, harvest, mode, quality, max(limit, 0))
+    logger.info(f"Harvesting profile @{username} ({mode})")
+    
+    return jsonify({
+        'harvest_id': harvest_id,
+        'username': username,
+        'status_url': f'/api/profile/{harvest_id}',
+        'files_url': f'/api/profile/{harvest_id}/files',
+        'message': 'Profile download started'
+    }), 202
+
+@app.route('/api/profile/<harvest_id>', methods=['GET'])
+def get_profile_harvest(harvest_id):
+    """Progress of a profile harvest"""
+    harvest = profile_harvests.get(harvest_id)
+    if harvest is None:
+        return jsonify({'error': 'Profile download not found'}), 404
+    return jsonify(public_harvest(harvest))
+
+@app.route('/api/profile/<harvest_id>/files', methods=['GET'])
+def list_profile_files(harvest_id):
+    """Files a profile harvest has downloaded, oldest first, with the URL to collect each"""
+    harvest = profile_harvests.get(harvest_id)
+    if harvest is None:
+        return jsonify({'error': 'Profile download not found'}), 404
+    files = [public_harvest_file(download_id) for download_id, entry in list(harvest_files.items())
+             if entry['harvest'] is harvest]
+    return jsonify({'harvest_id': harvest_id, 'files': files})
+
 @app.route('/api/video-info', methods=['POST'])
+@rate_limited('extraction')
 def get_video_info():
     """Get TikTok video information"""
     try:
@@ -879,17 +2841,33 @@ def get_video_info():
             return jsonify({'error': 'Only TikTok URLs are supported'}), 400
         
         try:
-            video_info = extractor.extract_direct_url(url)
+            quality = parse_quality(data.get('quality'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        try:
+            video_info = resolve_video_info(url, quality=quality)
         except Exception as e:
             return jsonify({'error': str(e)}), 400
         
+        probed_size = wait_for_media_probe(video_info)
+        
+        # Probe and keep the direct URL warm for the download that usually follows;
+        # a range the media probe just read already shows the URL is live
+        start_prefetch(url, video_info, filesize=probed_size)
+        
         return jsonify({
             'title': video_info['title'],
             'filename': video_info['filename'],
             'filesize': video_info['filesize'],
             'duration': video_info.get('duration'),
+            'width': video_info.get('width'),
+            'height': video_info.get('height'),
+            'bitrate': video_info.get('bitrate'),
             'platform': 'tiktok',
+            'quality': quality,
             'thumbnail': video_info.get('thumbnail'),
+            'thumbnail_url': register_thumbnail(url, video_info),
             'uploader': video_info.get('uploader'),
             'view_count': video_info.get('view_count'),
             'streaming_available': True
@@ -898,28 +2876,132 @@ def get_video_info():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_MEMORY_MB * 1024 * 1024, THUMBNAIL_DISK_MB * 1024 * 1024)
+
+def fetch_thumbnail(video_id):
+    """Download a thumbnail from the CDN once and cache the original bytes"""
+    source = thumbnail_sources[video_id]
+    headers = source['headers'].copy()
+    headers.update({
+        'Accept': 'image/avif,image/webp,image/*,*/*;q=0.8',
+        'Referer': 'https://www.tiktok.com/',
+    })
+    headers.setdefault('User-Agent', random.choice(extractor.tiktok_extractor.user_agents))
+    
+    response = cdn_session.get(source['url'], headers=headers, stream=True, timeout=(5, 10), verify=False)
+    try:
+        content_type = response.headers.get('content-type', '').split(';')[0].strip()
+        if response.status_code != 200 or not content_type.startswith('image/'):
+            raise Exception(f"Thumbnail returned HTTP {response.status_code} ({content_type or 'no type'})")
+        data = response.raw.read(THUMBNAIL_MAX_BYTES + 1, decode_content=True)
+        if len(data) > THUMBNAIL_MAX_BYTES:
+            raise Exception("Thumbnail is too large")
+    finally:
+        response.close()
+    
+    thumbnail_cache.put(video_id, 0, data, content_type)
+    return data, content_type
+
+def _run_thumbnail_fetch(video_id):
+    try:
+        return fetch_thumbnail(video_id)
+    except Exception as e:
+        logger.warning(f"Thumbnail fetch failed for {video_id}: {str(e)}")
+        return None
+    finally:
+        thumbnail_jobs.pop(video_id, None)
+
+def get_thumbnail(video_id, width):
+    """Return (bytes, content_type) for a thumbnail variant, fetching it at most once"""
+    cached = thumbnail_cache.get(video_id, width)
+    if cached is not None:
+        THUMBNAIL_REQUESTS.labels('hit').inc()
+        return cached
+    
+    original = thumbnail_cache.get(video_id, 0)
+    if original is None:
+        if video_id not in thumbnail_sources:
+            return None
+        THUMBNAIL_REQUESTS.labels('fetch').inc()
+        # Concurrent requests for the same video share one CDN fetch
+        if video_id not in thumbnail_jobs:
+            thumbnail_jobs[video_id] = eventlet.spawn(_run_thumbnail_fetch, video_id)
+        original = thumbnail_jobs[video_id].wait()
+        if original is None:
+            return None
+    else:
+        THUMBNAIL_REQUESTS.labels('resize').inc()
+    
+    if not width:
+        return original
+    try:
+        # Decoding and scaling is CPU work, so keep it off the event loop
+        resized = tpool.execute(resize_image, original[0], width)
+    except Exception as e:
+        logger.warning(f"Thumbnail resize failed for {video_id}: {str(e)}")
+        resized = None
+    if resized is None:
+        # Without Pillow the original is served as-is
+        return original
+    thumbnail_cache.put(video_id, width, *resized)
+    return resized
+
+@app.route('/api/thumbnail/<video_id>', methods=['GET'])
+def serve_thumbnail(video_id):
+    """Serve a cached, resized thumbnail for a video seen by the extractors"""
+    if not re.fullmatch(r'[0-9A-Za-z]{1,32}', video_id):
+        return jsonify({'error': 'Invalid video id'}), 400
+    
+    thumbnail = get_thumbnail(video_id, variant_width(request.args.get('w', 240)))
+    if thumbnail is None:
+        return jsonify({'error': 'Thumbnail not found'}), 404
+    
+    data, content_type = thumbnail
+    return Response(data, mimetype=content_type, headers={
+        'Cache-Control': 'public, max-age=604800, immutable',
+        'Access-Control-Allow-Origin': '*'
+    })
+
 @app.route('/api/downloads', methods=['GET'])
 def list_downloads():
-    """Get list of downloads"""
+    """Get a newest-first page of downloads
+    
+    Query parameters: limit (default 50, max 200), cursor (next_cursor of the
+    previous page) and status (comma-separated filter, e.g. completed,error).
+    """
     # Clean up old downloads before listing
     cleanup_old_downloads()
     
+    try:
+        downloads, next_cursor = downloads_page(request.args)
+    except ValueError:
+        return jsonify({'error': 'limit and cursor must be positive integers'}), 400
+    
     return jsonify({
-        'active_downloads': list(active_downloads.values()),
-        'total_active': len(active_downloads)
+        'active_downloads': downloads,
+        'total_active': len(active_downloads.active),
+        'total': len(active_downloads),
+        'next_cursor': next_cursor
     })
 
+@app.route('/api/downloads/<download_id>/trace', methods=['GET'])
+def get_download_trace(download_id):
+    """Get the phase timeline of a download"""
+    download = active_downloads.get(download_id)
+    if download is None:
+        return jsonify({'error': 'Download not found'}), 404
+    
+    trace = download.get('trace')
+    if trace is None:
+        return jsonify({'error': 'No trace recorded for this download'}), 404
+    
+    return jsonify(trace.to_dict())
+
 @app.route('/api/downloads/clear', methods=['POST'])
 def clear_downloads():
     """Clear completed downloads"""
-    global active_downloads
-    before_count = len(active_downloads)
-    active_downloads = {
-        k: v for k, v in active_downloads.items() 
-        if v['status'] in ['queued', 'starting', 'streaming', 'ready']
-    }
-    cleared_count = before_count - len(active_downloads)
-    socketio.emit('downloads_cleared')
+    cleared_count = active_downloads.clear_finished(IN_PROGRESS_STATUSES)
+    socket_emit('downloads_cleared')
     return jsonify({
         'message': 'Downloads cleared',
         'cleared_count': cleared_count,
@@ -940,11 +3022,17 @@ def health_check():
         'environment': os.environ.get('NODE_ENV', 'development')
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics for extraction, streaming and Socket.IO traffic"""
+    return Response(REGISTRY.render(), mimetype=METRICS_CONTENT_TYPE)
+
 # WebSocket handlers
 @socketio.on('connect')
 def handle_connect():
     logger.info(f"Client connected: {request.sid}")
-    emit('connected', {
+    start_delta_sync()
+    client_emit('connected', {
         'message': 'Connected to Enhanced TikTok Downloader',
         'active_downloads': len(active_downloads),
         'environment': os.environ.get('NODE_ENV', 'development')
@@ -955,20 +3043,66 @@ def handle_disconnect():
     logger.info(f"Client disconnected: {request.sid}")
 
 @socketio.on('get_downloads')
-def handle_get_downloads():
+def handle_get_downloads(data=None):
     cleanup_old_downloads()
-    emit('downloads_update', {
-        'downloads': list(active_downloads.values()),
-        'total': len(active_downloads)
+    try:
+        downloads, next_cursor = downloads_page(data if isinstance(data, dict) else {})
+    except ValueError:
+        downloads, next_cursor = downloads_page({})
+    client_emit('downloads_update', {
+        'downloads': downloads,
+        'total': len(active_downloads),
+        'next_cursor': next_cursor
     })
 
+@socketio.on('sync_downloads')
+def handle_sync_downloads(data=None):
+    """Send the changes after the client's version; since 0 (or a stale version) gets a snapshot"""
+    since = data.get('since') if isinstance(data, dict) else None
+    client_emit('downloads_delta', downloads_delta(since if isinstance(since, int) else 0))
+
+# Frontend files are compressed once and served from memory with validators
+static_files = StaticFiles(os.path.dirname(os.path.abspath(__file__)))
+static_files.preload('index.html')
+
+def static_response(path):
+    """Serve a cached static file, answering conditional requests with 304"""
+    asset = static_files.get(path)
+    if asset is None:
+        return send_from_directory('.', path)
+    
+    encoding, body, etag = asset.select(request.headers.get('Accept-Encoding'))
+    if path == 'index.html':
+        cache_control = 'no-cache'
+    elif is_versioned(path, request.query_string.decode('latin-1')):
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'public, max-age=300, must-revalidate'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(asset.mtime),
+        'Cache-Control': cache_control,
+        'Vary': 'Accept-Encoding',
+    }
+    
+    if_none_match = request.headers.get('If-None-Match')
+    if_modified_since = parse_date(request.headers.get('If-Modified-Since'))
+    if asset.matches(if_none_match) or (
+            not if_none_match and if_modified_since and int(asset.mtime) <= if_modified_since.timestamp()):
+        return Response(status=304, headers=headers)
+    
+    response = Response(body, mimetype=asset.mimetype, headers=headers)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    return response
+
 @app.route('/')
 def serve_frontend():
-    return send_from_directory('.', 'index.html')
+    return static_response('index.html')
 
 @app.route('/<path:path>')
 def serve_static(path):
-    return send_from_directory('.', path)
+    return static_response(path)
 
 def main():
     print("🎵 Enhanced TikTok Video Downloader Starting...")
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+TikTok Downloader - Parser Microbenchmarks
+Runs each extractor's response parser over recorded responses and compares
+ops/sec and memory per call against a stored baseline.
+
+Usage:
+    python benchmarks/bench_parsers.py
+    python benchmarks/bench_parsers.py --update-baseline
+    python benchmarks/bench_parsers.py --fixtures path/to/recordings --threshold 0.2
+
+Fixtures are matched to parsers by file name prefix (tikmate*, snaptik*,
+ssstik*, tikwm*, tikfast*, ytdlp*), so new recordings can be dropped into
+the fixtures directory as-is. The baseline is machine specific; refresh it
+with --update-baseline on the machine that runs the comparison.
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from app import TikTokExtractor  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures' / 'parsers'
+BASELINE = Path(__file__).resolve().parent / 'parser_baseline.json'
+VIDEO_URL = 'https://www.tiktok.com/@creator_name/video/7418473929385012522'
+
+def build_parsers(extractor):
+    """Map fixture name prefixes to parser calls"""
+    return {
+        'tikmate': lambda data: extractor._parse_tikmate_response(data, VIDEO_URL, 'https://tikmate.cc'),
+        'snaptik': lambda data: extractor._parse_snaptik_response(data, VIDEO_URL),
+        'ssstik': lambda data: extractor._parse_ssstik_response(data, VIDEO_URL),
+        'tikwm': lambda data: extractor._parse_tikwm_response(data, VIDEO_URL),
+        'tikfast': lambda data: extractor._parse_tikfast_response(data, VIDEO_URL),
+        # yt-dlp hands the parser a decoded info dict, not text
+        'ytdlp': lambda data: extractor._parse_ytdlp_info(data, VIDEO_URL),
+    }
+
+def load_fixtures(directory, parsers):
+    """Yield (name, parser, payload) for every recognised fixture"""
+    for path in sorted(Path(directory).iterdir()):
+        prefix = next((p for p in parsers if path.name.startswith(p)), None)
+        if prefix is None:
+            continue
+        payload = path.read_text(encoding='utf-8')
+        if prefix == 'ytdlp':
+            payload = json.loads(payload)
+        yield path.name, parsers[prefix], payload
+
+def bench(parse, payload, min_time):
+    """Return (ops/sec, peak bytes allocated per call)"""
+    result = parse(payload)
+    if not result or not result.get('direct_url'):
+        raise RuntimeError("parser returned no direct_url")
+
+    # Calibrate a batch size that runs for roughly a tenth of min_time
+    batch = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(batch):
+            parse(payload)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / 10:
+            break
+        batch *= 2
+
+    runs = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < min_time:
+        for _ in range(batch):
+            parse(payload)
+        runs += batch
+    ops = runs / (time.perf_counter() - started)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    parse(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return ops, peak - before
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark extractor response parsers")
+    parser.add_argument('--fixtures', default=str(FIXTURES), help="Directory of recorded responses")
+    parser.add_argument('--baseline', default=str(BASELINE), help="Baseline JSON file")
+    parser.add_argument('--min-time', type=float, default=0.5, help="Seconds to run each parser")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed ops/sec drop before failing")
+    parser.add_argument('--update-baseline', action='store_true', help="Store these results as the new baseline")
+    args = parser.parse_args()
+
+    parsers = build_parsers(TikTokExtractor())
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+
+    results = {}
+    regressions = []
+
+    print(f"{'fixture':<16}{'ops/sec':>12}{'peak KB/op':>12}{'baseline':>12}{'change':>9}")
+    print("-" * 61)
+    for name, parse, payload in load_fixtures(args.fixtures, parsers):
+        ops, peak = bench(parse, payload, args.min_time)
+        results[name] = {'ops_per_sec': round(ops, 1), 'peak_bytes': peak}
+
+        reference = baseline.get(name, {}).get('ops_per_sec')
+        change = ''
+        if reference:
+            ratio = ops / reference - 1
+            change = f"{ratio:+.1%}"
+            if ratio < -args.threshold:
+                regressions.append(name)
+                change += ' ❌'
+        print(f"{name:<16}{ops:>12,.0f}{peak / 1024:>12.1f}{reference or '-':>12}{change:>9}")
+
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+        print(f"\n💾 Baseline written to {baseline_path}")
+        return 0
+
+    if regressions:
+        print(f"\n❌ Slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+
+    print("\n✅ No parser regressions")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
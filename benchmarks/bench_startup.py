@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+TikTok Downloader - Cold Start Benchmark
+Breaks down the cost of importing app.py with `python -X importtime` and
+measures how long server.py takes to answer its first request.
+
+Usage:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 5 --top 20
+    python benchmarks/bench_startup.py --imports-only
+
+Each run uses a fresh interpreter, so the numbers include reading cached
+bytecode but not compiling it; delete __pycache__ directories first to
+simulate a brand new deploy.
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from loadtest import free_port  # noqa: E402
+
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+def import_profile():
+    """Import app in a fresh interpreter and return [(module, self_us, cumulative_us, depth)]"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=str(ROOT),
+        capture_output=True,
+        text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    if not any(module == 'app' for module, *_ in rows):
+        raise RuntimeError(f"import app failed:\n{result.stderr[-2000:]}")
+    return rows
+
+def first_response_time():
+    """Seconds from launching server.py until /api/health answers"""
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), HOST='127.0.0.1', NODE_ENV='benchmark')
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, str(ROOT / 'server.py')],
+        cwd=str(ROOT),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = started + 60
+        while time.perf_counter() < deadline:
+            try:
+                if requests.get(f'http://127.0.0.1:{port}/api/health', timeout=1).ok:
+                    return time.perf_counter() - started
+            except requests.exceptions.RequestException:
+                time.sleep(0.02)
+        raise RuntimeError("Server did not answer within 60 seconds")
+    finally:
+        process.terminate()
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold start cost")
+    parser.add_argument('--runs', type=int, default=3, help="Fresh interpreters per measurement")
+    parser.add_argument('--top', type=int, default=15, help="Modules to list by cumulative import time")
+    parser.add_argument('--imports-only', action='store_true', help="Skip starting the server")
+    args = parser.parse_args()
+
+    profiles = [import_profile() for _ in range(args.runs)]
+    totals = [next(cum for module, _, cum, _ in rows if module == 'app') / 1e6 for rows in profiles]
+
+    # Average each top-level dependency of app (depth 1) across runs
+    direct = {}
+    for rows in profiles:
+        for module, _, cumulative, depth in rows:
+            if depth == 1:
+                direct.setdefault(module, []).append(cumulative / 1e6)
+    imported = {module for module, *_ in profiles[-1]}
+
+    print(f"📦 import app: median {statistics.median(totals) * 1000:.0f} ms over {args.runs} runs")
+    print(f"\n{'module imported by app':<32}{'ms':>10}{'share':>9}")
+    print("-" * 51)
+    ranked = sorted(direct.items(), key=lambda item: -statistics.median(item[1]))
+    for module, samples in ranked[:args.top]:
+        seconds = statistics.median(samples)
+        print(f"{module:<32}{seconds * 1000:>10.1f}{seconds / statistics.median(totals):>9.0%}")
+
+    print("\nDeferred until after startup:")
+    for module in ('yt_dlp', 'PIL'):
+        state = '❌ imported at startup' if module in imported else '✅ not imported'
+        print(f"  {module:<30}{state}")
+
+    if not args.imports_only:
+        samples = [first_response_time() for _ in range(args.runs)]
+        print(f"\n🚀 server.py to first /api/health response: median {statistics.median(samples):.2f}s "
+              f"(min {min(samples):.2f}s, max {max(samples):.2f}s)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
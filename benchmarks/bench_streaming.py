@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+TikTok Downloader - Streaming CPU Benchmark
+Streams a video from the local fake CDN through perform_streaming and
+reports CPU time per MB, comparing fixed 32 KB reads with adaptive sizing.
+
+Usage:
+    python benchmarks/bench_streaming.py
+    python benchmarks/bench_streaming.py --streams 20 --video-size 31457280
+"""
+
+import argparse
+import logging
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import app  # noqa: E402
+
+def start_cdn(video_size, bandwidth):
+    """Run the load test's fake CDN in its own process so its CPU is not counted"""
+    process = subprocess.Popen(
+        [sys.executable, str(ROOT / 'benchmarks' / 'loadtest.py'), '--cdn-only',
+         '--video-size', str(video_size), '--bandwidth', str(bandwidth)],
+        stdout=subprocess.PIPE,
+        text=True
+    )
+    return process, process.stdout.readline().strip()
+
+def stream_once(cdn_url):
+    """Consume one stream and return (bytes, chunks)"""
+    download_id = str(uuid.uuid4())
+    app.active_downloads[download_id] = app.DownloadRecord(
+        id=download_id,
+        url=cdn_url,
+        status='ready',
+        created_at=app.datetime.now().isoformat(),
+    )
+    video_info = {'direct_url': cdn_url, 'headers': {}, 'filesize': None}
+
+    total = chunks = 0
+    with app.app.test_request_context(f'/api/stream/{download_id}'):
+        for chunk in app.perform_streaming(cdn_url, video_info, download_id, 'bench.mp4'):
+            total += len(chunk)
+            chunks += 1
+
+    del app.active_downloads[download_id]
+    return total, chunks
+
+def run(label, cdn_url, streams, chunk_min, chunk_max):
+    app.STREAM_CHUNK_MIN = chunk_min
+    app.STREAM_CHUNK_MAX = chunk_max
+    stream_once(cdn_url)  # warm up the connection pool
+
+    total = chunks = 0
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    for _ in range(streams):
+        size, count = stream_once(cdn_url)
+        total += size
+        chunks += count
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - wall_started
+
+    megabytes = total / 1e6
+    print(f"{label:<22}{cpu * 1000 / megabytes:>12.2f}{chunks / streams:>14.0f}{megabytes / wall:>12.1f}")
+    return cpu / megabytes
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU per MB streamed through perform_streaming")
+    parser.add_argument('--streams', type=int, default=10, help="Streams per configuration")
+    parser.add_argument('--video-size', type=int, default=30 * 1024 * 1024, help="Fake video size in bytes")
+    parser.add_argument('--bandwidth', type=int, default=0, help="CDN bytes/second (0 = unlimited)")
+    args = parser.parse_args()
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    process, cdn_url = start_cdn(args.video_size, args.bandwidth)
+
+    try:
+        print(f"{'configuration':<22}{'CPU ms/MB':>12}{'chunks/stream':>14}{'MB/s':>12}")
+        print("-" * 60)
+        fixed = run('fixed 32 KB', cdn_url, args.streams, 32768, 32768)
+        adaptive = run('adaptive 32 KB - 1 MB', cdn_url, args.streams, 32768, 1048576)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    print(f"\n📊 Adaptive reads use {adaptive / fixed:.0%} of the fixed-size CPU per MB")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
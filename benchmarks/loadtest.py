@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+TikTok Downloader - Offline Load Test
+Starts local stand-ins for TikMate, TikWM, SSSTik and the video CDN, runs the
+server against them and drives concurrent quick+stream download flows.
+
+Usage:
+    python benchmarks/loadtest.py --clients 50 --flows 200
+    python benchmarks/loadtest.py --latency 0.3 --failure-rate 0.2 --bandwidth 2000000
+
+Nothing leaves the machine: the server only talks to the local stand-ins.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import parse_qs
+
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+
+class FakeSettings:
+    """Behaviour shared by the stand-in services"""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, bandwidth=0, video_size=5 * 1024 * 1024):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.bandwidth = bandwidth
+        self.video = os.urandom(64 * 1024) * (video_size // (64 * 1024) or 1)
+        self.cdn_url = None
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Base handler adding latency and random failures"""
+
+    protocol_version = 'HTTP/1.1'
+    settings = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _delay_or_fail(self):
+        if self.settings.latency:
+            time.sleep(self.settings.latency)
+        if random.random() < self.settings.failure_rate:
+            self._reply(500, b'simulated failure', 'text/plain')
+            return True
+        return False
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length).decode('utf-8') if length else ''
+
+    def _reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class FakeTikMate(FakeHandler):
+    """POST /download returning TikMate's JSON answer"""
+
+    def do_POST(self):
+        self._read_body()
+        if self._delay_or_fail():
+            return
+        body = json.dumps({'success': True, 'url': self.settings.cdn_url, 'title': 'Load test video'})
+        self._reply(200, body.encode('utf-8'), 'application/json')
+
+class FakeTikWM(FakeHandler):
+    """POST /api/ returning TikWM's JSON answer"""
+
+    def do_POST(self):
+        form = parse_qs(self._read_body())
+        if self._delay_or_fail():
+            return
+        video_id = re.search(r'/video/(\d+)', form.get('url', [''])[0])
+        body = json.dumps({
+            'code': 0,
+            'data': {
+                'id': video_id.group(1) if video_id else '0',
+                'title': 'Load test video',
+                'play': self.settings.cdn_url,
+                'hdplay': self.settings.cdn_url,
+                'duration': 15,
+                'cover': None,
+                'author': {'unique_id': 'loadtest'},
+                'play_count': 0,
+            }
+        })
+        self._reply(200, body.encode('utf-8'), 'application/json')
+
+class FakeSSSTik(FakeHandler):
+    """GET / landing page and POST /abc returning SSSTik's HTML answer"""
+
+    def do_GET(self):
+        self._reply(200, b'<html><body><form></form></body></html>', 'text/html')
+
+    def do_POST(self):
+        self._read_body()
+        if self._delay_or_fail():
+            return
+        body = (
+            '<div><p class="maintext">Load test video</p>'
+            f'<a href="{self.settings.cdn_url}" class="download_link">Download Without Watermark</a></div>'
+        )
+        self._reply(200, body.encode('utf-8'), 'text/html')
+
+class FakeCDN(FakeHandler):
+    """MP4 CDN with Range support and an optional per-connection bandwidth cap"""
+
+    def _serve(self, send_body):
+        video = self.settings.video
+        start, end = 0, len(video) - 1
+        range_header = self.headers.get('Range')
+
+        if range_header:
+            match = re.match(r'bytes=(\d*)-(\d*)', range_header)
+            start = int(match.group(1) or 0)
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(video)}')
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        if not send_body:
+            return
+
+        piece = 64 * 1024
+        try:
+            for offset in range(start, end + 1, piece):
+                self.wfile.write(video[offset:min(offset + piece, end + 1)])
+                if self.settings.bandwidth:
+                    time.sleep(piece / self.settings.bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        self._serve(True)
+
+    def do_HEAD(self):
+        self._serve(False)
+
+def start_fake(handler_class, settings):
+    """Start a stand-in service on a free local port and return its base URL"""
+    handler = type(handler_class.__name__, (handler_class,), {'settings': settings})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(port, fakes, services):
+    """Run server.py against the stand-ins in a subprocess"""
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(port),
+        'HOST': '127.0.0.1',
+        'NODE_ENV': 'loadtest',
+        'TIKMATE_DOMAINS': fakes['tikmate'],
+        'TIKWM_API_URL': fakes['tikwm'] + '/api/',
+        'SSSTIK_URL': fakes['ssstik'],
+        'EXTRACTION_SERVICES': services,
+        # Every simulated client shares one IP, so per-client limits would skew results
+        'RATE_LIMIT_ENABLED': 'false',
+    })
+    process = subprocess.Popen(
+        [sys.executable, str(ROOT / 'server.py')],
+        cwd=str(ROOT),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f'{base_url}/api/health', timeout=1).ok:
+                return process, base_url
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+
+    process.kill()
+    raise RuntimeError("Server did not start within 30 seconds")
+
+class ProcessSampler:
+    """Sample CPU time and RSS of the server process in the background"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.cpu_start = None
+        self.cpu_end = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _read(self):
+        try:
+            import psutil
+            process = psutil.Process(self.pid)
+            times = process.cpu_times()
+            return times.user + times.system, process.memory_info().rss
+        except ImportError:
+            # Linux fallback without psutil
+            fields = Path(f'/proc/{self.pid}/stat').read_text().rsplit(')', 1)[1].split()
+            ticks = os.sysconf('SC_CLK_TCK')
+            cpu = (int(fields[11]) + int(fields[12])) / ticks
+            rss = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+            return cpu, rss
+
+    def _run(self):
+        while not self._stop.is_set():
+            cpu, rss = self._read()
+            self.peak_rss = max(self.peak_rss, rss)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self.cpu_start, _ = self._read()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.cpu_end, rss = self._read()
+        self.peak_rss = max(self.peak_rss, rss)
+        return self.cpu_end - self.cpu_start
+
+def run_flow(base_url, index):
+    """One quick+stream flow, as the frontend does it"""
+    url = f'https://www.tiktok.com/@loadtest/video/{7000000000000000000 + index}'
+    result = {'ok': False, 'bytes': 0}
+    started = time.time()
+
+    try:
+        response = requests.post(f'{base_url}/api/download/quick', json={'url': url}, timeout=120)
+        result['quick'] = time.time() - started
+        if response.status_code != 200:
+            result['error'] = f'quick HTTP {response.status_code}'
+            return result
+
+        stream_started = time.time()
+        with requests.get(base_url + response.json()['stream_url'], stream=True, timeout=120) as stream:
+            if stream.status_code != 200:
+                result['error'] = f'stream HTTP {stream.status_code}'
+                return result
+            for chunk in stream.iter_content(chunk_size=65536):
+                if 'ttfb' not in result:
+                    result['ttfb'] = time.time() - stream_started
+                result['bytes'] += len(chunk)
+
+        result['total'] = time.time() - started
+        result['ok'] = True
+    except requests.exceptions.RequestException as e:
+        result['error'] = type(e).__name__
+
+    return result
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(results, wall_time, cpu_seconds, peak_rss, video_size):
+    ok = [r for r in results if r['ok']]
+    errors = {}
+    for r in results:
+        if not r['ok']:
+            errors[r.get('error', 'unknown')] = errors.get(r.get('error', 'unknown'), 0) + 1
+    total_bytes = sum(r['bytes'] for r in results)
+
+    summary = {
+        'flows': len(results),
+        'succeeded': len(ok),
+        'failed': len(results) - len(ok),
+        'errors': errors,
+        'truncated': sum(1 for r in ok if r['bytes'] < video_size),
+        'wall_time': round(wall_time, 3),
+        'flows_per_second': round(len(ok) / wall_time, 2) if wall_time else 0,
+        'throughput_mb_s': round(total_bytes / wall_time / 1e6, 2) if wall_time else 0,
+        'server_cpu_seconds': round(cpu_seconds, 3),
+        'server_cpu_percent': round(cpu_seconds / wall_time * 100, 1) if wall_time else 0,
+        'server_cpu_ms_per_mb': round(cpu_seconds * 1000 / (total_bytes / 1e6), 2) if total_bytes else 0,
+        'server_peak_rss_mb': round(peak_rss / 1e6, 1),
+    }
+    for key in ('quick', 'ttfb', 'total'):
+        values = [r[key] for r in ok if key in r]
+        summary[f'{key}_p50'] = round(percentile(values, 50), 4)
+        summary[f'{key}_p99'] = round(percentile(values, 99), 4)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for /api/download/quick + /api/stream")
+    parser.add_argument('--clients', type=int, default=20, help="Concurrent clients")
+    parser.add_argument('--flows', type=int, default=100, help="Total quick+stream flows")
+    parser.add_argument('--latency', type=float, default=0.05, help="Stand-in scraper latency in seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Probability a scraper call fails")
+    parser.add_argument('--bandwidth', type=int, default=0, help="CDN bytes/second per connection (0 = unlimited)")
+    parser.add_argument('--video-size', type=int, default=5 * 1024 * 1024, help="Size of the fake MP4 in bytes")
+    parser.add_argument('--services', default='TikMate,TikWM,SSSTik', help="EXTRACTION_SERVICES for the server")
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    parser.add_argument('--cdn-only', action='store_true', help="Only serve the fake CDN and print its video URL")
+    args = parser.parse_args()
+
+    if args.cdn_only:
+        cdn_settings = FakeSettings(0.0, 0.0, args.bandwidth, args.video_size)
+        print(start_fake(FakeCDN, cdn_settings) + '/video/loadtest.mp4', flush=True)
+        threading.Event().wait()
+        return 0
+
+    settings = FakeSettings(args.latency, args.failure_rate, args.bandwidth, args.video_size)
+    cdn_settings = FakeSettings(0.0, 0.0, args.bandwidth, args.video_size)
+    cdn_settings.video = settings.video
+
+    settings.cdn_url = start_fake(FakeCDN, cdn_settings) + '/video/loadtest.mp4'
+    fakes = {
+        'tikmate': start_fake(FakeTikMate, settings),
+        'tikwm': start_fake(FakeTikWM, settings),
+        'ssstik': start_fake(FakeSSSTik, settings),
+    }
+
+    process, base_url = start_server(free_port(), fakes, args.services)
+    sampler = ProcessSampler(process.pid)
+
+    try:
+        if not args.json:
+            print(f"🚀 {args.flows} flows, {args.clients} concurrent clients against {base_url}")
+        sampler.start()
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            results = list(pool.map(lambda i: run_flow(base_url, i), range(args.flows)))
+        wall_time = time.time() - started
+        cpu_seconds = sampler.stop()
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    summary = summarize(results, wall_time, cpu_seconds, sampler.peak_rss, len(settings.video))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print("=" * 50)
+        for key, value in summary.items():
+            print(f"{key:>24}: {value}")
+
+    return 0 if summary['failed'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
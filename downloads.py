@@ -0,0 +1,228 @@
+"""
+Download records for the TikTok downloader
+Records have a fixed set of fields; finished ones move to a bounded history
+"""
+
+import heapq
+import itertools
+from collections import OrderedDict, deque
+from operator import attrgetter
+
+# Every field a download record can carry; anything else is a bug
+FIELDS = (
+    'id', 'url', 'status', 'platform', 'title', 'filename', 'filesize', 'mimetype', 'created_at',
+    'type', 'mode', 'quality', 'service', 'delivery', 'thumbnail_url', 'trace',
+    'total_bytes', 'downloaded_bytes', 'speed', 'percentage', 'eta', 'total_time', 'error',
+    'queue_position', 'estimated_wait', 'queued_at', 'file_url', 'expires_at', 'harvest_id',
+)
+_FIELD_SET = frozenset(FIELDS)
+
+# Fields kept out of API and Socket.IO payloads
+PRIVATE_FIELDS = frozenset({'trace', 'queued_at'})
+
+# Fields the progress ticker rewrites every tick; they travel in its batched messages
+PROGRESS_FIELDS = frozenset({'downloaded_bytes', 'speed', 'percentage', 'eta'})
+
+# Statuses after which a download no longer changes on its own
+FINAL_STATUSES = frozenset({'completed', 'error', 'redirected', 'cancelled', 'expired'})
+
+class VersionClock:
+    """Process-wide counter stamped on every change to a download"""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def tick(self):
+        self.value += 1
+        return self.value
+
+clock = VersionClock()
+
+class DownloadRecord:
+    """A download with fixed slots instead of a per-record dict
+
+    Supports the mapping operations the app uses (record['status'],
+    .get, .update, .setdefault, .items), so it can stand in for the old
+    dicts. Unset fields behave like missing keys. Every change stamps the
+    record with a new version, which is what delta sync is built on.
+    """
+
+    __slots__ = FIELDS + ('seq', 'version')
+
+    def __init__(self, **fields):
+        self.seq = 0
+        self.version = 0
+        self.update(fields)
+
+    def __getitem__(self, key):
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in _FIELD_SET:
+            raise KeyError(f"Unknown download field: {key}")
+        setattr(self, key, value)
+        self.version = clock.tick()
+
+    def __contains__(self, key):
+        return key in _FIELD_SET and hasattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in _FIELD_SET:
+            return default
+        return getattr(self, key, default)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, fields):
+        for key, value in fields.items():
+            if key not in _FIELD_SET:
+                raise KeyError(f"Unknown download field: {key}")
+            setattr(self, key, value)
+        self.version = clock.tick()
+
+    def set_progress(self, fields):
+        """Write progress fields without stamping a new version
+
+        Progress has its own batched Socket.IO messages, so a record whose
+        bytes moved is not worth a delta on top. The values still show up
+        in snapshots and in the next delta for any other change.
+        """
+        for key, value in fields.items():
+            if key not in PROGRESS_FIELDS:
+                raise KeyError(f"Not a progress field: {key}")
+            setattr(self, key, value)
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in FIELDS if hasattr(self, key)]
+
+    def to_dict(self):
+        """Public fields as a plain dict, for JSON payloads"""
+        return {key: value for key, value in self.items() if key not in PRIVATE_FIELDS}
+
+class DownloadStore:
+    """Downloads by id: in-flight ones, plus a ring buffer of finished ones
+
+    Removed ids are remembered (up to history_size of them) with the
+    version they were removed at, so changes() can describe removals.
+    """
+
+    def __init__(self, history_size=500):
+        self.history_size = history_size
+        self.active = {}
+        self.finished = OrderedDict()
+        self.removed = deque()
+        # Clients behind this version may have missed removals, so need a full resync
+        self.removed_floor = 0
+
+    @property
+    def version(self):
+        return clock.value
+
+    def __setitem__(self, download_id, record):
+        record.seq = record.version = clock.tick()
+        self.finished.pop(download_id, None)
+        self.active[download_id] = record
+
+    def _forget(self, download_id):
+        if len(self.removed) >= self.history_size:
+            self.removed_floor = self.removed.popleft()[0]
+        self.removed.append((clock.tick(), download_id))
+
+    def __getitem__(self, download_id):
+        record = self.get(download_id)
+        if record is None:
+            raise KeyError(download_id)
+        return record
+
+    def __delitem__(self, download_id):
+        if self.active.pop(download_id, None) is None:
+            del self.finished[download_id]
+        self._forget(download_id)
+
+    def __contains__(self, download_id):
+        return download_id in self.active or download_id in self.finished
+
+    def __len__(self):
+        return len(self.active) + len(self.finished)
+
+    def get(self, download_id, default=None):
+        record = self.active.get(download_id)
+        if record is None:
+            record = self.finished.get(download_id, default)
+        return record
+
+    def keys(self):
+        return list(self.active) + list(self.finished)
+
+    def values(self):
+        return itertools.chain(self.active.values(), self.finished.values())
+
+    def retire(self, download_id):
+        """Move a download into the history, dropping the oldest finished ones"""
+        record = self.active.pop(download_id, None)
+        if record is None:
+            return
+        self.finished[download_id] = record
+        while len(self.finished) > self.history_size:
+            self._forget(self.finished.popitem(last=False)[0])
+
+    def retire_finished(self):
+        """Retire in-flight records that already reached a final status"""
+        for download_id in [k for k, record in self.active.items() if record.get('status') in FINAL_STATUSES]:
+            self.retire(download_id)
+
+    def clear_finished(self, in_progress):
+        """Forget every download whose status is not in in_progress; returns how many"""
+        cleared = list(self.finished)
+        self.finished.clear()
+        cleared += [k for k, record in self.active.items() if record.get('status') not in in_progress]
+        for download_id in cleared:
+            self.active.pop(download_id, None)
+            self._forget(download_id)
+        return len(cleared)
+
+    def page(self, limit, cursor=None, statuses=None):
+        """Newest-first page of records, and the cursor for the next page (or None)
+
+        The cursor is the sequence number of the last record returned, so
+        pages stay stable while new downloads are added.
+        """
+        records = (
+            record for record in self.values()
+            if (cursor is None or record.seq < cursor)
+            and (not statuses or record.get('status') in statuses)
+        )
+        page = heapq.nlargest(limit + 1, records, key=attrgetter('seq'))
+        next_cursor = page[limit - 1].seq if len(page) > limit else None
+        return page[:limit], next_cursor
+
+    def changes(self, since, snapshot_limit):
+        """What changed after version since: (reset, added, updated, removed_ids)
+
+        added is newest first. When since is unknown, too old to have every
+        removal, or from before a restart, reset is True and added is a
+        fresh snapshot of the newest snapshot_limit records instead.
+        """
+        if not since or since < self.removed_floor or since > clock.value:
+            records, _ = self.page(snapshot_limit)
+            return True, records, [], []
+
+        added, updated = [], []
+        for record in self.values():
+            if record.seq > since:
+                added.append(record)
+            elif record.version > since:
+                updated.append(record)
+        added.sort(key=attrgetter('seq'), reverse=True)
+        removed = [download_id for version, download_id in self.removed if version > since]
+        return False, added, updated, removed
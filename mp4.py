@@ -0,0 +1,251 @@
+"""
+Minimal MP4 box parsing for the TikTok downloader
+Finds top-level boxes with small Range reads, reads movie metadata, and moves a trailing
+moov to the front (faststart)
+"""
+
+import struct
+
+# Boxes on the way from moov down to the chunk offset tables
+STBL_PATH = frozenset({b'moov', b'trak', b'mdia', b'minf', b'stbl'})
+# Boxes on the way from moov down to the movie and track headers
+HEADER_PATH = frozenset({b'moov', b'trak'})
+BOX_HEADER_MAX = 16
+MAX_TOP_LEVEL_BOXES = 64
+
+class MP4Error(Exception):
+    """Raised for MP4 data this parser does not handle"""
+
+def read_box_header(data, offset=0):
+    """Return (box_type, box_size, header_size) for the box at offset, or None if truncated
+
+    A box_size of 0 means the box runs to the end of the file.
+    """
+    if len(data) - offset < 8:
+        return None
+    size, box_type = struct.unpack_from('>I4s', data, offset)
+    header_size = 8
+    if size == 1:
+        if len(data) - offset < 16:
+            return None
+        size = struct.unpack_from('>Q', data, offset + 8)[0]
+        header_size = 16
+    if size != 0 and size < header_size:
+        raise MP4Error(f"Invalid size {size} for box {box_type!r}")
+    return box_type, size, header_size
+
+def iter_boxes(data, start=0, end=None):
+    """Yield (box_type, offset, size, header_size) for the boxes in data[start:end]"""
+    end = len(data) if end is None else end
+    offset = start
+    while offset < end:
+        header = read_box_header(data, offset)
+        if header is None:
+            raise MP4Error("Truncated box header")
+        box_type, size, header_size = header
+        if size == 0:
+            size = end - offset
+        if offset + size > end:
+            raise MP4Error(f"Box {box_type!r} overruns its parent")
+        yield box_type, offset, size, header_size
+        offset += size
+
+def top_level_boxes(fetch, file_size, head=b'', stop_after=None):
+    """List top-level boxes as [(box_type, offset, size)] without reading their bodies
+
+    fetch(start, end) returns the bytes start..end inclusive; headers inside
+    head (the first bytes of the file) are read from it instead. With
+    stop_after, the listing ends at the first box of that type.
+    """
+    boxes = []
+    offset = 0
+    while offset < file_size:
+        if offset + BOX_HEADER_MAX <= len(head):
+            chunk = head[offset:offset + BOX_HEADER_MAX]
+        else:
+            chunk = fetch(offset, min(offset + BOX_HEADER_MAX, file_size) - 1)
+        header = read_box_header(chunk)
+        if header is None:
+            raise MP4Error(f"Truncated box header at {offset}")
+        box_type, size, _ = header
+        if size == 0:
+            size = file_size - offset
+        boxes.append((box_type, offset, size))
+        offset += size
+        if box_type == stop_after:
+            return boxes
+        if len(boxes) > MAX_TOP_LEVEL_BOXES:
+            raise MP4Error("Too many top-level boxes")
+    if offset != file_size:
+        raise MP4Error(f"Boxes end at {offset}, file is {file_size} bytes")
+    return boxes
+
+def shift_chunk_offsets(moov, delta, threshold=0):
+    """Return a copy of a moov box with stco/co64 entries at or past threshold moved by delta"""
+    data = bytearray(moov)
+    header = read_box_header(data)
+    if header is None or header[0] != b'moov':
+        raise MP4Error("Not a moov box")
+    _shift_children(data, header[2], len(data), delta, threshold)
+    return bytes(data)
+
+def _shift_children(data, start, end, delta, threshold):
+    for box_type, offset, size, header_size in iter_boxes(data, start, end):
+        body = offset + header_size
+        if box_type in STBL_PATH:
+            _shift_children(data, body, offset + size, delta, threshold)
+        elif box_type in (b'stco', b'co64'):
+            # version/flags, entry count, then 32-bit (stco) or 64-bit (co64) offsets
+            code, entry_size = ('I', 4) if box_type == b'stco' else ('Q', 8)
+            count = struct.unpack_from('>I', data, body + 4)[0]
+            table = body + 8
+            if table + count * entry_size > offset + size:
+                raise MP4Error(f"{box_type.decode()} table overruns its box")
+            entries = struct.unpack_from(f'>{count}{code}', data, table)
+            shifted = [entry + delta if entry >= threshold else entry for entry in entries]
+            if box_type == b'stco' and shifted and max(shifted) > 0xFFFFFFFF:
+                raise MP4Error("Shifted chunk offsets no longer fit in stco")
+            struct.pack_into(f'>{count}{code}', data, table, *shifted)
+        elif box_type == b'cmov':
+            raise MP4Error("Compressed moov boxes are not supported")
+
+def read_movie_info(moov):
+    """Duration in seconds and display width/height from a moov box that may be cut short
+
+    Values missing from the bytes given are None. The size comes from the
+    first track with non-zero dimensions, swapped for 90/270 degree rotation.
+    """
+    info = {'duration': None, 'width': None, 'height': None}
+    try:
+        _read_headers(moov, 0, len(moov), info)
+    except (struct.error, IndexError):
+        raise MP4Error("Truncated movie or track header") from None
+    return info
+
+def _read_headers(data, start, end, info):
+    offset = start
+    while offset < end:
+        header = read_box_header(data, offset)
+        if header is None:
+            return
+        box_type, size, header_size = header
+        box_end = end if size == 0 else offset + size
+        body = offset + header_size
+        if box_type in HEADER_PATH:
+            # Containers may be truncated; read whatever children are complete
+            _read_headers(data, body, min(box_end, end), info)
+        elif box_end <= end:
+            if box_type == b'mvhd' and info['duration'] is None:
+                info['duration'] = _movie_duration(data, body)
+            elif box_type == b'tkhd' and info['width'] is None:
+                dimensions = _track_size(data, body, box_end)
+                if dimensions is not None:
+                    info['width'], info['height'] = dimensions
+        offset = box_end
+
+def _movie_duration(data, body):
+    # version/flags, creation and modification times, timescale, duration
+    if data[body] == 1:
+        timescale, duration = struct.unpack_from('>IQ', data, body + 20)
+        unknown = 0xFFFFFFFFFFFFFFFF
+    else:
+        timescale, duration = struct.unpack_from('>II', data, body + 12)
+        unknown = 0xFFFFFFFF
+    if not timescale or not duration or duration == unknown:
+        return None
+    return round(duration / timescale, 3)
+
+def _track_size(data, body, end):
+    # The matrix and 16.16 fixed-point width/height close the box
+    matrix = body + (52 if data[body] == 1 else 40)
+    if matrix + 44 > end:
+        return None
+    a, b = struct.unpack_from('>ii', data, matrix)
+    width, height = struct.unpack_from('>II', data, matrix + 36)
+    width, height = width >> 16, height >> 16
+    if not width or not height:
+        return None
+    if a == 0 and b != 0:
+        width, height = height, width
+    return width, height
+
+def probe_metadata(fetch, file_size, head, max_moov_size=8 * 1024 * 1024):
+    """Duration, display size and average bitrate (bits per second) of an MP4
+
+    moov is found from box headers: inside head for faststart files, or with
+    a few header reads for one at the end, whose start is then read as a
+    tail range. The rest of moov is read only if the headers were not in
+    that first part.
+    """
+    boxes = top_level_boxes(fetch, file_size, head, stop_after=b'moov')
+    if boxes[-1][0] != b'moov':
+        raise MP4Error("No moov box")
+    if any(box_type == b'moof' for box_type, _, _ in boxes):
+        raise MP4Error("Fragmented MP4")
+    _, moov_offset, moov_size = boxes[-1]
+    if moov_size > max_moov_size:
+        raise MP4Error(f"moov is {moov_size} bytes")
+
+    moov_end = moov_offset + moov_size
+    if moov_offset < len(head):
+        moov = bytes(head[moov_offset:moov_end])
+    else:
+        moov = fetch(moov_offset, min(moov_end, moov_offset + max(len(head), BOX_HEADER_MAX)) - 1)
+    info = read_movie_info(moov)
+    if (info['duration'] is None or info['width'] is None) and moov_offset + len(moov) < moov_end:
+        moov += fetch(moov_offset + len(moov), moov_end - 1)
+        info = read_movie_info(moov)
+    if info['duration'] is None:
+        raise MP4Error("No movie duration")
+
+    info['bitrate'] = int(file_size * 8 / info['duration'])
+    return info
+
+class FaststartPlan:
+    """How to send a moov-at-end file in faststart order
+
+    Send prefix (the boxes before mdat, then the patched moov), followed by
+    the original bytes body_start..body_end inclusive. The total size is
+    unchanged because moov only moves.
+    """
+
+    __slots__ = ('prefix', 'body_start', 'body_end')
+
+    def __init__(self, prefix, body_start, body_end):
+        self.prefix = prefix
+        self.body_start = body_start
+        self.body_end = body_end
+
+def plan_faststart(fetch, file_size, head, max_moov_size=8 * 1024 * 1024):
+    """Return a FaststartPlan when moov follows the media data, or None when it already leads
+
+    Raises MP4Error for layouts this cannot rewrite safely: fragmented files,
+    boxes after moov, header boxes beyond head, or an oversized moov.
+    """
+    boxes = top_level_boxes(fetch, file_size, head)
+    types = [box_type for box_type, _, _ in boxes]
+    if types.count(b'moov') != 1 or b'mdat' not in types:
+        raise MP4Error("Not a progressive MP4")
+    if b'moof' in types:
+        raise MP4Error("Fragmented MP4")
+
+    moov_index = types.index(b'moov')
+    mdat_index = types.index(b'mdat')
+    if moov_index < mdat_index:
+        return None
+    if moov_index != len(boxes) - 1:
+        raise MP4Error("Boxes follow moov")
+
+    _, moov_offset, moov_size = boxes[moov_index]
+    _, mdat_offset, _ = boxes[mdat_index]
+    if mdat_offset > len(head):
+        raise MP4Error("Header boxes do not fit in the head read")
+    if moov_size > max_moov_size:
+        raise MP4Error(f"moov is {moov_size} bytes")
+
+    moov = fetch(moov_offset, moov_offset + moov_size - 1)
+    if len(moov) != moov_size:
+        raise MP4Error("Short moov read")
+    # Everything from mdat on now sits moov_size bytes later in the file
+    moov = shift_chunk_offsets(moov, moov_size, mdat_offset)
+    return FaststartPlan(bytes(head[:mdat_offset]) + moov, mdat_offset, moov_offset - 1)
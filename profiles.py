@@ -0,0 +1,90 @@
+"""
+TikTok profile harvesting for the downloader and the CLI
+Videos are enumerated lazily with yt-dlp, and finished ones are recorded so a run can resume
+"""
+
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PATTERN = re.compile(
+    r'^(?:https?://(?:www\.|m\.)?tiktok\.com/)?@([\w.-]{1,64})/?(?:[?#].*)?$', re.IGNORECASE
+)
+VIDEO_ID_PATTERN = re.compile(r'/video/(\d+)')
+
+def profile_username(value):
+    """Username from '@name' or https://www.tiktok.com/@name, or None for anything else"""
+    match = PROFILE_PATTERN.match((value or '').strip())
+    return match.group(1) if match else None
+
+def profile_url(username):
+    return f"https://www.tiktok.com/@{username}"
+
+def iter_profile_videos(username, yt_dlp=None):
+    """Yield (video_id, url) for every video on a profile, newest first
+
+    The playlist is extracted flat and unprocessed, so yt-dlp fetches the
+    next page of the profile only when the caller asks for more videos.
+    """
+    if yt_dlp is None:
+        import yt_dlp
+
+    options = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'lazy_playlist': True,
+        'skip_download': True,
+    }
+    with yt_dlp.YoutubeDL(options) as ydl:
+        info = ydl.extract_info(profile_url(username), download=False, process=False)
+        for entry in (info or {}).get('entries') or ():
+            if not entry:
+                continue
+            url = entry.get('url') or entry.get('webpage_url') or ''
+            video_id = str(entry.get('id') or '')
+            if not video_id:
+                match = VIDEO_ID_PATTERN.search(url)
+                video_id = match.group(1) if match else ''
+            if not video_id:
+                continue
+            if not url.startswith('http'):
+                url = f"{profile_url(username)}/video/{video_id}"
+            yield video_id, url
+
+class HarvestState:
+    """Append-only file of finished video ids for one profile
+
+    Each finished video is one line, flushed straight away, so an
+    interrupted run loses at most the videos that were in flight.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.lock = threading.Lock()
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.done.update(line.strip() for line in f if line.strip())
+        except FileNotFoundError:
+            pass
+        if self.done:
+            logger.info(f"Resuming {os.path.basename(path)}: {len(self.done)} videos already done")
+
+    def __contains__(self, video_id):
+        return video_id in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def mark_done(self, video_id):
+        with self.lock:
+            if video_id in self.done:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(video_id + '\n')
+            self.done.add(video_id)
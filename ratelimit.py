@@ -0,0 +1,111 @@
+"""
+Token-bucket rate limiting for the TikTok downloader
+In-memory buckets by default, with an optional Redis backend shared between workers
+"""
+
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+class MemoryBucketStore:
+    """Token buckets kept in this process"""
+
+    def __init__(self, max_keys=50000):
+        self.max_keys = max_keys
+        self.buckets = {}
+
+    def take(self, key, rate, capacity, cost=1):
+        """Take tokens from a bucket, returning (allowed, seconds until allowed)"""
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+
+        if tokens >= cost:
+            self.buckets[key] = (tokens - cost, now)
+            allowed, retry_after = True, 0.0
+        else:
+            self.buckets[key] = (tokens, now)
+            allowed, retry_after = False, (cost - tokens) / rate
+
+        if len(self.buckets) > self.max_keys:
+            self._prune()
+        return allowed, retry_after
+
+    def _prune(self):
+        """Forget the least recently created buckets once there are too many"""
+        for key in list(self.buckets):
+            if len(self.buckets) <= self.max_keys // 2:
+                break
+            del self.buckets[key]
+
+class RedisBucketStore:
+    """Token buckets in Redis so every worker shares the same budget"""
+
+    TAKE_SCRIPT = """
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, url, prefix='tiktok:ratelimit:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL is set but the 'redis' package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.script = self.client.register_script(self.TAKE_SCRIPT)
+
+    def take(self, key, rate, capacity, cost=1):
+        """Take tokens from a shared bucket, failing open if Redis is unavailable"""
+        try:
+            allowed, tokens = self.script(keys=[self.prefix + key], args=[rate, capacity, time.time(), cost])
+        except Exception as e:
+            logger.warning(f"Rate limit backend unavailable, allowing request: {str(e)}")
+            return True, 0.0
+        if int(allowed):
+            return True, 0.0
+        return False, (cost - float(tokens)) / rate
+
+def parse_budget(value, default):
+    """Parse a 'requests/seconds' budget such as '20/60' into (rate, capacity)"""
+    try:
+        count, seconds = (value or default).split('/')
+        count, seconds = float(count), float(seconds)
+        if count <= 0 or seconds <= 0:
+            raise ValueError
+    except ValueError:
+        logger.warning(f"Invalid rate limit budget {value!r}, using {default}")
+        count, seconds = (float(part) for part in default.split('/'))
+    return count / seconds, count
+
+class RateLimiter:
+    """Separate token-bucket budgets keyed by client"""
+
+    def __init__(self, store, budgets, enabled=True):
+        self.store = store
+        self.budgets = budgets
+        self.enabled = enabled
+
+    def check(self, budget, client_key):
+        """Return (allowed, retry_after seconds) for one request from a client"""
+        if not self.enabled:
+            return True, 0.0
+        rate, capacity = self.budgets[budget]
+        allowed, retry_after = self.store.take(f"{budget}:{client_key}", rate, capacity)
+        return allowed, max(1, math.ceil(retry_after)) if not allowed else 0
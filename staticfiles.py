@@ -0,0 +1,121 @@
+"""
+Precompressed static file cache for the TikTok downloader frontend
+Files are read and compressed once, then served from memory until they change on disk
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Text types worth compressing; images and fonts are already compressed
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml',
+                      'application/manifest+json', 'application/xml')
+MIN_COMPRESS_SIZE = 1024
+
+# Filenames with a content hash, e.g. app.3f9c2b1a.js, never change once published
+VERSIONED_NAME = re.compile(r'\.[0-9a-f]{8,}\.[a-z0-9]+$', re.IGNORECASE)
+
+class StaticAsset:
+    """One file with its compressed variants and validators"""
+
+    __slots__ = ('path', 'mtime', 'size', 'mimetype', 'etag', 'variants')
+
+    def __init__(self, path, data, mtime, mimetype):
+        self.path = path
+        self.mtime = mtime
+        self.size = len(data)
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(data).hexdigest()[:20]
+        self.variants = {'identity': data}
+
+        if len(data) >= MIN_COMPRESS_SIZE and mimetype.startswith(COMPRESSIBLE_TYPES):
+            self._add_variant('gzip', gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                self._add_variant('br', brotli.compress(data, quality=11))
+
+    def _add_variant(self, encoding, data):
+        # Only keep encodings that actually save bytes
+        if len(data) < self.size:
+            self.variants[encoding] = data
+
+    def select(self, accept_encoding):
+        """Return (encoding, body, etag) for the best encoding the client accepts"""
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and encoding in accepted:
+                suffix = 'br' if encoding == 'br' else 'gz'
+                return encoding, self.variants[encoding], f'"{self.etag}-{suffix}"'
+        return 'identity', self.variants['identity'], f'"{self.etag}"'
+
+    def matches(self, if_none_match):
+        """True when an If-None-Match header names any variant of this file"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return any(tag.strip('"').split('-')[0] == self.etag for tag in tags)
+
+def _accepted_encodings(header):
+    """Encodings from an Accept-Encoding header, ignoring q=0 entries"""
+    accepted = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if re.search(r'q\s*=\s*0(\.0*)?\s*$', params):
+            continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+def is_versioned(path, query_string=''):
+    """True for assets whose URL changes whenever their content does"""
+    return bool(VERSIONED_NAME.search(path)) or re.search(r'(^|&)v=', query_string or '') is not None
+
+class StaticFiles:
+    """In-memory cache of frontend files under a root directory"""
+
+    def __init__(self, root, extensions=('.html', '.js', '.css', '.svg', '.ico', '.png', '.jpg',
+                                         '.jpeg', '.webp', '.json', '.txt', '.map', '.webmanifest',
+                                         '.woff', '.woff2')):
+        self.root = os.path.abspath(root)
+        self.extensions = extensions
+        self.assets = {}
+
+    def preload(self, *names):
+        """Read and compress files up front so the first request is served from memory"""
+        for name in names:
+            asset = self.get(name)
+            if asset is not None:
+                logger.info(f"Static {name}: {asset.size} bytes, encodings {sorted(asset.variants)}")
+
+    def get(self, name):
+        """Return the cached asset for a relative path, reloading it if the file changed"""
+        if not name.lower().endswith(self.extensions):
+            return None
+        path = os.path.abspath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep):
+            return None
+
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self.assets.pop(path, None)
+            return None
+
+        asset = self.assets.get(path)
+        if asset is None or asset.mtime != mtime:
+            with open(path, 'rb') as f:
+                data = f.read()
+            mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            asset = self.assets[path] = StaticAsset(path, data, mtime, mimetype)
+        return asset
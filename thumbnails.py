@@ -0,0 +1,132 @@
+"""
+Bounded thumbnail cache for the TikTok downloader
+Small resized variants are kept in memory and on disk; resizing uses Pillow when it is installed
+"""
+
+import hashlib
+import io
+import logging
+import os
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Widths the endpoint serves; requests are rounded up to one of these so few variants exist
+VARIANT_WIDTHS = (120, 240, 480)
+
+def variant_width(requested):
+    """Round a requested width up to a served variant, or 0 for the original"""
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return VARIANT_WIDTHS[0]
+    if requested <= 0:
+        return 0
+    return next((width for width in VARIANT_WIDTHS if width >= requested), VARIANT_WIDTHS[-1])
+
+def resize_image(data, width):
+    """Return (bytes, content_type) scaled down to width, or None without Pillow
+
+    Output is JPEG (WebP would be smaller but not every Pillow build has it).
+    Pillow is imported on first use so it does not slow down startup.
+    """
+    if not width:
+        return None
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        output = io.BytesIO()
+        image.convert('RGB').save(output, 'JPEG', quality=80, optimize=True, progressive=True)
+    return output.getvalue(), 'image/jpeg'
+
+class ThumbnailCache:
+    """LRU of image variants in memory, backed by a size-capped directory"""
+
+    def __init__(self, directory, max_memory_bytes=8 * 1024 * 1024, max_disk_bytes=128 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.disk_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def get(self, video_id, width):
+        """Return (bytes, content_type) for a cached variant, or None"""
+        key = f"{video_id}:{width}"
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory.move_to_end(key)
+            return entry
+
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                content_type, _, data = f.read().partition(b'\n')
+            # Touch the file so disk eviction is least-recently-used too
+            os.utime(path)
+        except OSError:
+            return None
+        entry = (data, content_type.decode('ascii'))
+        self._remember(key, entry)
+        return entry
+
+    def put(self, video_id, width, data, content_type):
+        """Store a variant in memory and on disk"""
+        key = f"{video_id}:{width}"
+        entry = (data, content_type)
+        self._remember(key, entry)
+        if not self.directory:
+            return
+        try:
+            path = self._path(key)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(content_type.encode('ascii') + b'\n' + data)
+            os.replace(path + '.tmp', path)
+            self.disk_bytes += len(data)
+            if self.disk_bytes > self.max_disk_bytes:
+                self._trim_disk()
+        except OSError as e:
+            logger.warning(f"Could not write thumbnail cache: {str(e)}")
+
+    def _remember(self, key, entry):
+        previous = self.memory.pop(key, None)
+        if previous is not None:
+            self.memory_bytes -= len(previous[0])
+        self.memory[key] = entry
+        self.memory_bytes += len(entry[0])
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            _, (data, _) = self.memory.popitem(last=False)
+            self.memory_bytes -= len(data)
+
+    def _trim_disk(self):
+        """Delete the least recently used files once the directory is over budget"""
+        files = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes * 0.8:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self.disk_bytes = total
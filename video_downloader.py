@@ -12,6 +12,11 @@ from pathlib import Path
 import requests
 import random
 import json
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from profiles import HarvestState, iter_profile_videos, profile_username
+
+# sd picks the standard encode, hd/max the HD one where a service offers both
+QUALITIES = ('sd', 'hd', 'max')
 
 class TikTokDownloader:
     def __init__(self, download_path="./tiktok_downloads"):
@@ -25,13 +30,28 @@ class TikTokDownloader:
             'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36',
         ]
 
-    def extract_video_url(self, url):
-        """Extract TikTok video using multiple services"""
-        services = [
-            ("TikMate", self._extract_with_tikmate),
-            ("SnapTik", self._extract_with_snaptik),
-            ("SSSTik", self._extract_with_ssstik),
-        ]
+    def extract_video_url(self, url, mode='video', quality=None):
+        """Extract TikTok video (or just its audio) using multiple services"""
+        if mode == 'audio':
+            # Only these services link the soundtrack separately
+            services = [
+                ("SSSTik", lambda u: self._extract_with_ssstik(u, mode='audio')),
+                ("TikWM", lambda u: self._extract_with_tikwm(u, mode='audio')),
+            ]
+        elif quality:
+            # Services offering more than one encode first, so the choice is honoured
+            services = [
+                ("TikWM", lambda u: self._extract_with_tikwm(u, quality=quality)),
+                ("SSSTik", lambda u: self._extract_with_ssstik(u, quality=quality)),
+                ("TikMate", self._extract_with_tikmate),
+                ("SnapTik", self._extract_with_snaptik),
+            ]
+        else:
+            services = [
+                ("TikMate", self._extract_with_tikmate),
+                ("SnapTik", self._extract_with_snaptik),
+                ("SSSTik", self._extract_with_ssstik),
+            ]
         
         for service_name, extract_func in services:
             try:
@@ -160,7 +180,7 @@ class TikTokDownloader:
         except Exception as e:
             raise Exception(f"SnapTik failed: {str(e)}")
 
-    def _extract_with_ssstik(self, url):
+    def _extract_with_ssstik(self, url, mode='video', quality=None):
         """Extract using SSSTik service"""
         try:
             session = requests.Session()
@@ -182,6 +202,14 @@ class TikTokDownloader:
                 r'href="([^"]+)"[^>]*>.*?Download Without Watermark',
                 r'href="([^"]+)"[^>]*>.*?Download MP4',
             ]
+            if quality in ('hd', 'max'):
+                patterns.insert(0, r'href="([^"]+)"[^>]*>.*?Download Without Watermark HD')
+            if mode == 'audio':
+                patterns = [
+                    r'<a[^>]+href="([^"]+)"[^>]*class="[^"]*\bmusic\b[^"]*"',
+                    r'href="([^"]+)"[^>]*>\s*Download MP3',
+                ]
+            extension = 'mp3' if mode == 'audio' else 'mp4'
             
             for pattern in patterns:
                 match = re.search(pattern, response.text, re.IGNORECASE | re.DOTALL)
@@ -193,7 +221,7 @@ class TikTokDownloader:
                     return {
                         'direct_url': download_url,
                         'title': title,
-                        'filename': f"TikTok_SSSTik_{self._clean_filename(title)}.mp4"
+                        'filename': f"TikTok_SSSTik_{self._clean_filename(title)}.{extension}"
                     }
             
             raise Exception("Download link not found")
@@ -201,19 +229,58 @@ class TikTokDownloader:
         except Exception as e:
             raise Exception(f"SSSTik failed: {str(e)}")
 
-    def download_video(self, url, custom_filename=None):
-        """Download TikTok video"""
+    def _extract_with_tikwm(self, url, mode='video', quality=None):
+        """Extract using the TikWM API, which links SD and HD encodes and the soundtrack"""
+        headers = {
+            'User-Agent': random.choice(self.user_agents),
+            'Accept': 'application/json, text/plain, */*',
+            'Referer': 'https://www.tikwm.com/',
+        }
+        response = requests.post('https://www.tikwm.com/api/', data={'url': url, 'hd': 1}, headers=headers, timeout=30)
+        response.raise_for_status()
+        
+        result = response.json()
+        if result.get('code') != 0:
+            raise Exception("API returned error")
+        
+        data = result.get('data', {})
+        if mode == 'audio':
+            media_url = data.get('music') or (data.get('music_info') or {}).get('play')
+        elif quality == 'sd':
+            media_url = data.get('play') or data.get('hdplay')
+        else:
+            media_url = data.get('hdplay') or data.get('play')
+        if not media_url:
+            raise Exception("No media URL found")
+        if media_url.startswith('//'):
+            media_url = 'https:' + media_url
+        elif media_url.startswith('/'):
+            media_url = 'https://www.tikwm.com' + media_url
+        
+        title = data.get('title') or f"TikTok_Video_{self._extract_video_id(url)}"
+        extension = 'mp3' if mode == 'audio' else 'mp4'
+        return {
+            'direct_url': media_url,
+            'title': title,
+            'filename': f"TikTok_TikWM_{self._clean_filename(title)}.{extension}"
+        }
+
+    def download_video(self, url, custom_filename=None, mode='video', quality=None):
+        """Download TikTok video, or only its audio with mode='audio'
+        
+        quality is 'sd', 'hd' or 'max'; None keeps each service's default encode.
+        """
         try:
-            print(f"\n🎬 Starting TikTok download: {url}")
+            print(f"\n🎬 Starting TikTok {'audio ' if mode == 'audio' else ''}download: {url}")
             
             # Extract video info
-            video_info = self.extract_video_url(url)
+            video_info = self.extract_video_url(url, mode, quality)
             if not video_info or not video_info.get('direct_url'):
                 raise Exception("No video URL found")
             
             # Use custom filename if provided
             if custom_filename:
-                filename = f"{custom_filename}.mp4"
+                filename = f"{custom_filename}{Path(video_info['filename']).suffix}"
             else:
                 filename = video_info['filename']
             
@@ -288,7 +355,7 @@ class TikTokDownloader:
             bytes_val /= 1024
         return f"{bytes_val:.1f} TB"
 
-    def batch_download(self, urls):
+    def batch_download(self, urls, quality=None):
         """Download multiple TikTok videos"""
         if not urls:
             print("❌ No URLs provided")
@@ -310,7 +377,7 @@ class TikTokDownloader:
             print(f"📥 [{i}/{total_urls}] Processing: {url}")
             
             try:
-                if self.download_video(url):
+                if self.download_video(url, quality=quality):
                     success_count += 1
                     print(f"✅ [{i}/{total_urls}] Successfully downloaded")
                 else:
@@ -329,6 +396,76 @@ class TikTokDownloader:
         
         return success_count > 0
 
+    def download_profile(self, profile, mode='video', quality=None, workers=3, limit=0):
+        """Download every video of a TikTok profile (@username)
+        
+        Videos are listed lazily and at most a few are queued ahead of the
+        workers, so memory stays flat for large profiles. Finished video ids
+        go to a state file in the download folder, and running it again
+        skips them.
+        """
+        username = profile_username(profile)
+        if not username:
+            print("❌ Please enter a profile such as @username or https://www.tiktok.com/@username")
+            return False
+        
+        state = HarvestState(str(self.download_path / f".profile_{username.lower()}.done"))
+        print(f"\n👤 Downloading profile @{username} with {workers} workers")
+        if len(state):
+            print(f"⏩ Resuming: {len(state)} videos already downloaded")
+        
+        counts = {'found': 0, 'skipped': 0, 'completed': 0, 'failed': 0}
+        
+        def fetch(video_id, url):
+            if self.download_video(url, f"{username}_{video_id}", mode=mode, quality=quality):
+                state.mark_done(video_id)
+                return True
+            return False
+        
+        def collect(futures):
+            for future in futures:
+                counts['completed' if future.result() else 'failed'] += 1
+        
+        pending = set()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for video_id, url in iter_profile_videos(username):
+                    counts['found'] += 1
+                    if video_id in state:
+                        counts['skipped'] += 1
+                        continue
+                    if limit and counts['completed'] + counts['failed'] + len(pending) >= limit:
+                        break
+                    # Keep only a couple of videos queued per worker
+                    if len(pending) >= workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    pending.add(pool.submit(fetch, video_id, url))
+                done, pending = wait(pending)
+                collect(done)
+        except ImportError:
+            print("❌ Profile downloads need yt-dlp: pip install yt-dlp")
+            return False
+        except Exception as e:
+            collect(pending)
+            print(f"\n❌ Listing @{username} failed: {str(e)}")
+            print("💡 Run it again to resume where it stopped")
+        
+        print(f"\n" + "="*50)
+        print(f"🎉 Profile @{username}: {counts['completed']} downloaded, "
+              f"{counts['skipped']} already done, {counts['failed']} failed ({counts['found']} listed)")
+        return counts['completed'] > 0
+
+def ask_quality():
+    """Prompt for a video quality; Enter keeps the default"""
+    while True:
+        quality = input("Quality (sd/hd/max, Enter for default): ").strip().lower()
+        if not quality:
+            return None
+        if quality in QUALITIES:
+            return quality
+        print("❌ Please enter sd, hd or max.")
+
 def main():
     """Main function for command-line usage"""
     print("🎵 Enhanced TikTok Video Downloader - Command Line")
@@ -341,15 +478,18 @@ def main():
         print("\n🎯 Options:")
         print("1. Download single TikTok video")
         print("2. Download multiple TikTok videos")
-        print("3. Exit")
+        print("3. Download audio only (MP3)")
+        print("4. Download all videos from a profile (@username)")
+        print("5. Exit")
         
-        choice = input("\nEnter your choice (1-3): ").strip()
+        choice = input("\nEnter your choice (1-5): ").strip()
         
         if choice == '1':
             url = input("Enter TikTok URL: ").strip()
             if url:
                 custom_name = input("Custom filename (optional): ").strip() or None
-                downloader.download_video(url, custom_name)
+                quality = ask_quality()
+                downloader.download_video(url, custom_name, quality=quality)
         
         elif choice == '2':
             print("Paste TikTok URLs (one per line). Press Enter twice when finished:")
@@ -364,9 +504,22 @@ def main():
                 urls.append(line.strip())
             
             if urls:
-                downloader.batch_download(urls)
+                downloader.batch_download(urls, ask_quality())
         
         elif choice == '3':
+            url = input("Enter TikTok URL: ").strip()
+            if url:
+                custom_name = input("Custom filename (optional): ").strip() or None
+                downloader.download_video(url, custom_name, mode='audio')
+        
+        elif choice == '4':
+            profile = input("Enter TikTok profile (@username or URL): ").strip()
+            if profile:
+                limit = input("Maximum videos (optional): ").strip()
+                downloader.download_profile(profile, quality=ask_quality(),
+                                            limit=int(limit) if limit.isdigit() else 0)
+        
+        elif choice == '5':
             print("👋 Thank you for using TikTok Downloader!")
             break
         